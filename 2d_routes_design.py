@@ -7,10 +7,14 @@ from numpy import array
 from line_fitting_helpers.bezier import *
 from line_fitting_helpers.fitCurves import *
 from line_fitting_helpers.bspline_path import *
+from line_fitting_helpers import binary_routes
 from Tkinter import *
 import tkMessageBox as mb
 import math
 
+# seconds of Bezier fitting per redraw while a point is dragged, the full fit follows on release
+DRAG_FIT_BUDGET = 0.03
+
 
 # center of bounding box
 def cntr(x1, y1, x2, y2):
@@ -33,13 +37,18 @@ class MyCanvas(Canvas):
 
 
     def create_bezier(self, b, tag):
-        self.create_polyline([bezier.q(b, t/float(self.sampling_rates)).tolist() for t in xrange(0, int(self.sampling_rates+1))], tag=tag, fill='blue', width='2') # there are better ways to draw a bezier
+        self.create_polyline(evaluate(b, samples=int(self.sampling_rates+1)).tolist(), tag=tag, fill='blue', width='2')
         #self.create_line(b[0].tolist(), b[1].tolist(), tag=tag)
         #self.create_point(b[1][0], b[1][1], 2, fill='black', tag=tag)
         #self.create_line(b[3].tolist(), b[2].tolist(), tag=tag)
         #self.create_point(b[2][0], b[2][1], 2, fill='black', tag=tag)
 
 
+    def create_bezier_chain(self, beziers, spacing, tag):
+        # waypoints every spacing along the whole chain, drawn (and saved) as one route
+        self.create_polyline(resampleChain(beziers, spacing).tolist(), tag=tag, fill='blue', width='2')
+
+
     def create_point(self, x, y, r, **kwargs):
         return self.create_oval(x-r, y-r, x+r, y+r, kwargs)
 
@@ -107,6 +116,8 @@ class MainObject:
         self.points = []
         self.vehicle_points = []
         self.sampling_rates = self.canvas.sampling_rates
+        # refit only the Bezier ranges a dragged point changes
+        self.fit_cache = FitCache()
         self.draggingPoint = None
         self.dragging_vehicle = None
         self.total_distance = 0
@@ -139,35 +150,41 @@ class MainObject:
          #print("mao:", map_)
          #print("vehicle:", vehicle_)
          #print("mode:", mode_)
-         with open(self.config_file, "w") as my_file:
-            lines = []
-            init_text = "x,y,z,yaw\n"
-            my_file.write(init_text)
-            for i in range(len(self.canvas.routes)):
-                x = 397 - self.canvas.routes[i][1] 
-                y = -290 + self.canvas.routes[i][0]
-                z = 0
-                if i < len(self.canvas.routes)-1:
-                    delta_x = -self.canvas.routes[i+1][0] + self.canvas.routes[i][0]
-                    delta_y = self.canvas.routes[i+1][1] - self.canvas.routes[i][1]
-                    yaw = (math.atan2(delta_x, delta_y))*180/math.pi + 180
-                else:
-                    delta_x = -self.canvas.routes[i][0] + self.canvas.routes[i-1][0]
-                    delta_y = self.canvas.routes[i][1] - self.canvas.routes[i-1][1]
-                    yaw = (math.atan2(delta_x, delta_y))*180/math.pi + 180
-                text = "{},{},{},{}\n".format(
-                    str(x), str(y), str(z),  str(yaw) 
-                )
-                lines.append(text)
-            my_file.writelines(lines)
-            end_text = "{},{},{}".format(
-                 str(map_),str(vehicle_),str(mode_)
-                )
-            my_file.write(end_text)
-            self.ifsave = 1
-            print("save successfully into {}!,please close design window".format(self.config_file))
-            if mb.askokcancel("QUIT", "routes are saved, do you want to quit to load you routes to scenario?"):
-                self.root.destroy()
+         waypoints = []
+         for i in range(len(self.canvas.routes)):
+             x = 397 - self.canvas.routes[i][1] 
+             y = -290 + self.canvas.routes[i][0]
+             z = 0
+             if i < len(self.canvas.routes)-1:
+                 delta_x = -self.canvas.routes[i+1][0] + self.canvas.routes[i][0]
+                 delta_y = self.canvas.routes[i+1][1] - self.canvas.routes[i][1]
+                 yaw = (math.atan2(delta_x, delta_y))*180/math.pi + 180
+             else:
+                 delta_x = -self.canvas.routes[i][0] + self.canvas.routes[i-1][0]
+                 delta_y = self.canvas.routes[i][1] - self.canvas.routes[i-1][1]
+                 yaw = (math.atan2(delta_x, delta_y))*180/math.pi + 180
+             waypoints.append((x, y, z, yaw))
+         if self.config_file.endswith(binary_routes.ROUTE_EXTENSION):
+             binary_routes.write_route(self.config_file, array(waypoints, dtype=float).reshape(-1, 4), map_, vehicle_, mode_)
+         else:
+             with open(self.config_file, "w") as my_file:
+                 lines = []
+                 init_text = "x,y,z,yaw\n"
+                 my_file.write(init_text)
+                 for x, y, z, yaw in waypoints:
+                     text = "{},{},{},{}\n".format(
+                         str(x), str(y), str(z),  str(yaw) 
+                     )
+                     lines.append(text)
+                 my_file.writelines(lines)
+                 end_text = "{},{},{}".format(
+                      str(map_),str(vehicle_),str(mode_)
+                     )
+                 my_file.write(end_text)
+         self.ifsave = 1
+         print("save successfully into {}!,please close design window".format(self.config_file))
+         if mb.askokcancel("QUIT", "routes are saved, do you want to quit to load you routes to scenario?"):
+             self.root.destroy()
 
     def add_vehicle(self,event):
         if mb.askokcancel("vehicle", "press your mouse to put the vehicle"):
@@ -214,13 +231,15 @@ class MainObject:
     def onMouseMove(self, event):
         if self.draggingPoint:
             self.canvas.coords(self.draggingPoint, event.x-4, event.y-4, event.x+4, event.y+4)
-            self.redraw()
+            self.redraw(DRAG_FIT_BUDGET)
         if self.dragging_vehicle:
             self.canvas.coords(self.dragging_vehicle, event.x-14, event.y-14, event.x, event.y)
             self.canvas.coords(self.dragging_rear, event.x-6, event.y-6, event.x+6, event.y+6)
 
     def onButton1Release(self, event):
-        self.draggingPoint = None
+        if self.draggingPoint:
+            self.draggingPoint = None
+            self.redraw()
 
 
     def onSpinBoxValueChange(self):
@@ -232,7 +251,7 @@ class MainObject:
         self.canvas.sampling_rates = int(self.total_distance/sampling_rates)
         self.redraw()
 
-    def redraw(self):
+    def redraw(self, budget=None):
         #set the ifsave
         self.ifsave = 0
         # redraw polyline
@@ -263,11 +282,13 @@ class MainObject:
         add your own fit algorithem here
         '''
         if self.function.get() == "Bezier":
-            beziers = fitCurve(points, float(self.spinbox.get())**2)
-            for bezier in beziers:
-                self.canvas.create_bezier(bezier, tag='bezier')
+            if budget is None:
+                beziers = fitCurve(points, float(self.spinbox.get())**2, cache=self.fit_cache)
+            else:
+                beziers, _ = fitCurveAnytime(points, float(self.spinbox.get())**2, budget, cache=self.fit_cache)
+            self.canvas.create_bezier_chain(beziers, sampling_rates, tag='bezier')
         elif self.function.get() == "B_spline":
-            B_splines = bspline_planning(points, self.canvas.sampling_rates)
+            B_splines = bspline_planning(points, self.canvas.sampling_rates).tolist()
             self.canvas.create_polyline(B_splines, tag='B_spline', fill='blue', width='2')
 if __name__ == '__main__':
     o = MainObject()
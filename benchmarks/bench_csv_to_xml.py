@@ -0,0 +1,56 @@
+"""
+    Benchmark of csv_to_xml_helper.all_csv_to_xml on synthetic routes.
+    call python benchmarks/bench_csv_to_xml.py [number of waypoints ...]
+    by default the route length goes from 1k to 1M waypoints
+"""
+from __future__ import print_function
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import csv_to_xml_helper
+
+SIZES = [1000, 10000, 100000, 1000000]
+
+
+def write_route_csv(filename, n_waypoints):
+    """Writes a sinusoidal route in the layout saved by the 2d designer."""
+    with open(filename, "w") as route_file:
+        route_file.write("x,y,z,yaw\n")
+        lines = []
+        for i in range(n_waypoints):
+            x = 0.5 * i
+            y = 20.0 * math.sin(x / 50.0)
+            yaw = math.degrees(math.atan2(0.4 * math.cos(x / 50.0), 1.0))
+            lines.append("{},{},{},{}\n".format(str(x), str(y), 0, str(yaw)))
+        route_file.writelines(lines)
+        route_file.write("Town_control,vehicle.lincoln.mkz201,no_obstacle")
+
+
+def main(sizes):
+    workdir = tempfile.mkdtemp()
+    try:
+        obstacle_csv = os.path.join(workdir, "config.csv")
+        with open(obstacle_csv, "w") as obstacle_file:
+            obstacle_file.write("x,y,z,pitch,roll,yaw,object_name\n")
+        xml_filename = os.path.join(workdir, "scenario.xml")
+        print("{:>10} {:>10} {:>14} {:>10}".format("waypoints", "seconds", "waypoints/s", "MB"))
+        for n_waypoints in sizes:
+            route_csv = os.path.join(workdir, "routes.csv")
+            write_route_csv(route_csv, n_waypoints)
+            start = time.time()
+            csv_to_xml_helper.all_csv_to_xml(obstacle_csv, route_csv, xml_filename)
+            seconds = time.time() - start
+            print("{:>10} {:>10.3f} {:>14.0f} {:>10.1f}".format(
+                n_waypoints, seconds, n_waypoints / max(seconds, 1e-9),
+                os.path.getsize(xml_filename) / 1e6))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
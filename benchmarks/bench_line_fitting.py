@@ -0,0 +1,150 @@
+"""
+    Benchmark of the line_fitting_helpers fitters on synthetic routes.
+    call python benchmarks/bench_line_fitting.py [--sizes 10 1000 ...] [--output results.json]
+                                                 [--baseline old.json [--threshold 1.5]]
+    by default the routes go from 10 to 10k control points, each one straight,
+    sinusoidal and noisy hand-drawn; add --sizes 10 100 1000 10000 100000 for the
+    long routes, which take minutes. With --baseline the exit status is 1 when any
+    case got slower than threshold times its baseline time.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from line_fitting_helpers.fitCurves import fitCurve
+from line_fitting_helpers.bspline_path import bspline_planning
+from line_fitting_helpers.catmull_rom_spline import catmull_rom
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+SIZES = [10, 100, 1000, 10000]
+SHAPES = ["straight", "sinusoidal", "hand_drawn"]
+# method -> (parameter name, values)
+CASES = {
+    "fitCurve": ("max_error", [1.0, 4.0, 16.0]),
+    "bspline_planning": ("sn", [100, 1000, 10000]),
+    "catmull_rom": ("res", [4, 8, 32]),
+}
+METHODS = ["fitCurve", "bspline_planning", "catmull_rom"]
+SPACING = 2.0
+# cases faster than this are never reported as regressions, their timing is noise
+NOISE_SECONDS = 0.005
+
+
+def make_route(shape, n_points, seed=0):
+    """(n_points, 2) control points about SPACING apart, as clicked or recorded."""
+    x = SPACING * np.arange(n_points, dtype=float)
+    if shape == "straight":
+        return np.column_stack((x, np.zeros(n_points)))
+    if shape == "sinusoidal":
+        return np.column_stack((x, 40.0 * np.sin(x / 60.0)))
+    if shape == "hand_drawn":
+        rng = np.random.RandomState(seed)
+        heading = np.cumsum(rng.normal(scale=0.08, size=n_points))
+        steps = SPACING * np.column_stack((np.cos(heading), np.sin(heading)))
+        return np.cumsum(steps, axis=0) + rng.normal(scale=0.3, size=(n_points, 2))
+    raise ValueError("unknown route shape {!r}".format(shape))
+
+
+def run_case(method, value, points):
+    if method == "fitCurve":
+        return len(fitCurve(points, value))
+    if method == "bspline_planning":
+        return len(bspline_planning(points, value))
+    return len(catmull_rom(points[:, 0], points[:, 1], value)[0])
+
+
+def measure(method, value, points, repeat):
+    """Best of repeat wall times, then the traced peak of one more run."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.time()
+        output = run_case(method, value, points)
+        best = min(best, time.time() - start)
+    peak_mb = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            run_case(method, value, points)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return best, peak_mb, output
+
+
+def case_key(result):
+    return "{method}/{parameter}={value}/{shape}/{size}".format(**result)
+
+
+def compare(results, baseline, threshold):
+    """Returns the (key, seconds, baseline seconds) of every regressed case."""
+    previous = dict((case_key(result), result["seconds"]) for result in baseline["results"])
+    regressions = []
+    for result in results:
+        before = previous.get(case_key(result))
+        if before is None or result["seconds"] < NOISE_SECONDS:
+            continue
+        if result["seconds"] > threshold * max(before, NOISE_SECONDS):
+            regressions.append((case_key(result), result["seconds"], before))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the line_fitting_helpers fitters.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of control points")
+    parser.add_argument("--shapes", nargs="+", default=SHAPES, choices=SHAPES)
+    parser.add_argument("--methods", nargs="+", default=METHODS, choices=METHODS)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, the best one counts")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the hand drawn routes")
+    parser.add_argument("--output", help="write the results as json")
+    parser.add_argument("--baseline", help="json results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.5,
+                        help="slowdown factor over the baseline that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = []
+    print("{:>16} {:>14} {:>11} {:>8} {:>10} {:>9} {:>8}".format(
+        "method", "parameter", "shape", "points", "seconds", "peak MB", "output"))
+    for method in args.methods:
+        parameter, values = CASES[method]
+        for value in values:
+            for shape in args.shapes:
+                for size in args.sizes:
+                    points = make_route(shape, size, args.seed)
+                    seconds, peak_mb, output = measure(method, value, points, args.repeat)
+                    results.append({"method": method, "parameter": parameter, "value": value,
+                                    "shape": shape, "size": size, "seconds": seconds,
+                                    "peak_mb": peak_mb, "output": output})
+                    print("{:>16} {:>14} {:>11} {:>8} {:>10.4f} {:>9} {:>8}".format(
+                        method, "{}={}".format(parameter, value), shape, size, seconds,
+                        "-" if peak_mb is None else "{:.2f}".format(peak_mb), output))
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"python": platform.python_version(), "numpy": np.__version__,
+                       "machine": platform.machine(), "repeat": args.repeat, "seed": args.seed,
+                       "results": results}, output_file, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for key, seconds, before in regressions:
+            print("REGRESSION {}: {:.4f}s, baseline {:.4f}s".format(key, seconds, before))
+        if regressions:
+            return 1
+        print("no case slower than {}x its baseline".format(args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,68 +2,723 @@
     Script usage:
     call python csv_to_xml_helper.py <input csv obstacle file> <input csv route file> <output csv route file>
     the output file will automatically placed under output_xmls file
+
+    batch usage:
+    call python csv_to_xml_helper.py --batch <manifest csv or directory> [-j <processes>]
+    a manifest lists one "<obstacle csv>,<route csv>,<output xml>" triple per line,
+    a directory is scanned for <name>_routes.csv files paired with <name>_config.csv,
+    each pair is converted to <name>.xml
+    with --bundle <output xml> all of them are written as <scenario> elements of one file
+    instead, each named after its output xml without extension; a scenario that cannot be
+    converted is reported and left out of the bundle
+
+    the scenario_runner configs directory is taken from --configs-dir, from the
+    SCENARIO_RUNNER_CONFIGS environment variable, or looked up once with RosPack and
+    cached in ~/.cache/self_driving_scenario_designer/configs_dir.
+    numpy and pandas are only imported for routes larger than CSV_ENGINE_MAX_BYTES.
+
+    --engine stream converts routes of any length with bounded memory: the metadata row is
+    read from the end of the file and the waypoints are read and written STREAM_CHUNK_ROWS
+    at a time. auto switches to it for routes larger than STREAM_ENGINE_MIN_BYTES.
+
+    --precision and --angle-precision write positions and angles with a fixed number of
+    decimals (--compact: centimetres and hundredths of a degree), --gzip compresses the xml.
+
+    --tolerance <metres> drops waypoints lying within that distance of the route through the
+    kept ones (Douglas-Peucker, see line_fitting_helpers/decimation.py), --yaw-tolerance
+    <degrees> bounds the heading error (DEFAULT_YAW_TOLERANCE by default); the number of dropped
+    waypoints is reported.
+
+    a route file ending with BINARY_ROUTE_EXTENSION is read as a binary route
+    (see line_fitting_helpers/binary_routes.py) instead of a csv file.
+
+    generated xml files are kept in a cache keyed by the hash of the input csv files
+    (~/.cache/self_driving_scenario_designer/scenarios, or $SCENARIO_XML_CACHE), unchanged
+    scenarios are copied from there instead of being converted again; --no-cache disables it.
 """
 
-import numpy as np
-import pandas as pd
-from rospkg import RosPack
+import argparse
+import functools
+import itertools
+import os
+import re
 import sys
+import time
+
+# number of xml lines joined into one write() call
+WRITE_BLOCK_LINES = 65536
+# routes up to this size are read with the csv module instead of pandas
+CSV_ENGINE_MAX_BYTES = 4 * 1024 * 1024
+# routes larger than this are streamed instead of being loaded at once
+STREAM_ENGINE_MIN_BYTES = 256 * 1024 * 1024
+STREAM_CHUNK_ROWS = 20000
+ENGINES = ("auto", "csv", "pandas", "stream")
+POSITION_KEYS = ("x", "y", "z")
+ANGLE_KEYS = ("yaw", "pitch", "roll")
+# centimetres and hundredths of a degree
+COMPACT_PRECISION = 2
+# heading error allowed by --tolerance when --yaw-tolerance is not given, in degrees
+DEFAULT_YAW_TOLERANCE = 2.0
+
+CONFIGS_DIR_ENV = "SCENARIO_RUNNER_CONFIGS"
+CONFIGS_DIR_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "self_driving_scenario_designer", "configs_dir")
+# line_fitting_helpers.binary_routes.ROUTE_EXTENSION, kept here so csv routes never import numpy
+BINARY_ROUTE_EXTENSION = ".route"
+XML_CACHE_ENV = "SCENARIO_XML_CACHE"
+XML_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "self_driving_scenario_designer", "scenarios")
+# bump whenever all_csv_to_xml writes different xml for the same input, it invalidates the xml cache
+XML_FORMAT_VERSION = 1
+
+# strings read_csv treats as missing values
+_NA_VALUES = frozenset(["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+                        "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"])
+_INT_PATTERN = re.compile(r"^[+-]?[0-9]+$")
+
+
+class OutputProfile(object):
+    """Options changing the xml written for a route.
+
+    tolerance: decimate the waypoints, keeping the route within this distance (metres)
+    yaw_tolerance: with tolerance, keep the heading within this many degrees as well
+    position_precision: number of decimals written for x, y and z (default: as read)
+    angle_precision: number of decimals written for yaw, pitch and roll (default: as read)
+    compress: write gzip compressed xml
+    """
+
+    def __init__(self, tolerance=None, yaw_tolerance=None, position_precision=None, angle_precision=None,
+                 compress=False):
+        if yaw_tolerance is not None and tolerance is None:
+            raise ValueError("yaw_tolerance needs a tolerance")
+        self.tolerance = tolerance
+        self.yaw_tolerance = yaw_tolerance
+        self.position_precision = position_precision
+        self.angle_precision = angle_precision
+        self.compress = compress
+
+    def key(self):
+        """Text identifying the profile in scenario_cache_key."""
+        return "tolerance={!r}\nyaw_tolerance={!r}\nposition_precision={!r}\nangle_precision={!r}\ncompress={!r}\n" \
+            .format(self.tolerance, self.yaw_tolerance, self.position_precision, self.angle_precision,
+                    bool(self.compress))
+
+    def format_columns(self, keys, columns):
+        """Rewrites the position and angle columns with their fixed precision, a whole column at a time."""
+        formats = {}
+        if self.position_precision is not None:
+            formats.update((key, _fixed_format(self.position_precision)) for key in POSITION_KEYS)
+        if self.angle_precision is not None:
+            formats.update((key, _fixed_format(self.angle_precision)) for key in ANGLE_KEYS)
+        if not formats:
+            return columns
+        return [list(map(formats[key], map(float, column))) if key in formats else column
+                for key, column in zip(keys, columns)]
+
+
+def _fixed_format(precision):
+    template = "{{:.{}f}}".format(precision).format
+    # adding 0.0 turns the -0.0 of small negative values into 0.0
+    return lambda value: template(round(value, precision) + 0.0)
+
+
+def _column_strings(frame):
+    """Returns one list of strings per column, equal to str(frame.iloc[i][key]) for every row."""
+    import numpy as np
+    import pandas as pd
+    if len(frame.columns) > 0 and all(pd.api.types.is_numeric_dtype(dtype) for dtype in frame.dtypes):
+        # a row of an all-numeric frame is upcast to the common dtype by iloc
+        frame = frame.astype(np.result_type(*frame.dtypes))
+    return [list(map(str, frame[key].tolist())) for key in frame.keys()]
+
+
+def _csv_column_kind(values):
+    """Returns the dtype read_csv would infer for a column: "int", "float" or "str"."""
+    kind = "int"
+    for value in values:
+        if value in _NA_VALUES:
+            kind = "float" if kind == "int" else kind
+        elif kind == "int" and _INT_PATTERN.match(value):
+            continue
+        else:
+            try:
+                float(value)
+            except ValueError:
+                return "str"
+            if "_" in value:
+                return "str"
+            kind = "float"
+    return kind
+
+
+def _csv_columns(csv_filename):
+    """Reads a csv file with the csv module.
+
+    Returns the header keys and one list of strings per column, formatted the same
+    way _column_strings formats the frame pd.read_csv would return.
+    """
+    import csv
+    with open(csv_filename) as csv_file:
+        reader = csv.reader(csv_file)
+        keys = next(reader)
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            if len(row) > len(keys):
+                raise ValueError("Expected {} fields in line {}, saw {}".format(len(keys), reader.line_num, len(row)))
+            rows.append(row + [""] * (len(keys) - len(row)))
+    values = list(zip(*rows)) if rows else [()] * len(keys)
+    kinds = [_csv_column_kind(column) for column in values]
+    if "str" not in kinds and "float" in kinds:
+        # a row of an all-numeric frame is upcast to float by iloc
+        kinds = ["float"] * len(kinds)
+    columns = []
+    for kind, column in zip(kinds, values):
+        if kind == "int":
+            columns.append([str(int(value)) for value in column])
+        elif kind == "float":
+            columns.append(["nan" if value in _NA_VALUES else str(float(value)) for value in column])
+        else:
+            columns.append(["nan" if value in _NA_VALUES else value for value in column])
+    return keys, columns
+
+
+def _read_columns(csv_filename, engine="auto"):
+    """Returns the keys and formatted columns of a csv file.
+
+    engine is "csv" (standard library), "pandas", or "auto" which picks the csv module
+    for files up to CSV_ENGINE_MAX_BYTES. "stream" reads the whole file with the csv module,
+    routes are streamed by _read_route.
+    """
+    if engine == "auto":
+        engine = "csv" if os.path.getsize(csv_filename) <= CSV_ENGINE_MAX_BYTES else "pandas"
+    if engine in ("csv", "stream"):
+        return _csv_columns(csv_filename)
+    if engine != "pandas":
+        raise ValueError("unknown engine {}".format(engine))
+    import pandas as pd
+    frame = pd.read_csv(csv_filename, float_precision="round_trip")
+    return list(frame.keys()), _column_strings(frame)
+
+
+def _is_binary_route(filename):
+    return os.path.splitext(filename)[1] == BINARY_ROUTE_EXTENSION
+
+
+def _stream_csv_blocks(csv_filename, n_text_columns, chunksize):
+    """Yields the formatted waypoint columns of a route csv, chunksize rows at a time.
+
+    The columns holding the metadata row are text columns for read_csv and are kept
+    verbatim, the others hold NaN in the metadata row and are formatted as floats.
+    """
+    import csv
+    with open(csv_filename) as csv_file:
+        reader = csv.reader(csv_file)
+        keys = next(reader)
+        rows = (row for row in reader if row)
+        block = list(itertools.islice(rows, chunksize))
+        while block:
+            following = list(itertools.islice(rows, chunksize))
+            if not following:
+                block.pop()    # the metadata row
+            if block:
+                columns = []
+                for k in range(len(keys)):
+                    values = [row[k] if k < len(row) else "" for row in block]
+                    if k < n_text_columns:
+                        columns.append(["nan" if value in _NA_VALUES else value for value in values])
+                    else:
+                        columns.append(["nan" if value in _NA_VALUES else str(float(value)) for value in values])
+                if any(len(row) > len(keys) for row in block):
+                    raise ValueError("Expected {} fields per line in {}".format(len(keys), csv_filename))
+                yield columns
+            block = following
+
+
+def _read_route(route_filename, engine="auto"):
+    """Returns the keys of a route, its (town, vehicle, mode) metadata and an iterator over
+    blocks of formatted waypoint columns.
+
+    Binary routes and the "stream" engine yield bounded blocks, the other engines yield
+    the whole route as one block.
+    """
+    if _is_binary_route(route_filename):
+        from line_fitting_helpers import binary_routes
+        waypoints, header = binary_routes.load_route(route_filename)
+        keys = list(waypoints.dtype.names)
+        blocks = ([list(map(str, waypoints[key][begin:begin + STREAM_CHUNK_ROWS].tolist())) for key in keys]
+                  for begin in range(0, len(waypoints), STREAM_CHUNK_ROWS))
+        return keys, (str(header["town"]), str(header["vehicle"]), str(header["mode"])), blocks
+    if engine == "auto" and os.path.getsize(route_filename) > STREAM_ENGINE_MIN_BYTES:
+        engine = "stream"
+    if engine == "stream":
+        import csv
+        with open(route_filename) as csv_file:
+            keys = next(csv.reader(csv_file))
+        metadata = read_route_metadata(route_filename)
+        return keys, metadata, _stream_csv_blocks(route_filename, len(metadata), STREAM_CHUNK_ROWS)
+    keys, columns = _read_columns(route_filename, engine)
+    metadata = tuple(column[-1] for column in columns[:3])
+    blocks = [[column[:-1] for column in columns]] if len(columns[0]) > 1 else []
+    return keys, metadata, iter(blocks)
+
+
+def _line_template(prefix, keys):
+    """Builds a str.format template writing every key as an xml attribute."""
+    line = prefix
+    for key in keys:
+        line += " {}=\"{{}}\"".format(str(key).replace("{", "{{").replace("}", "}}"))
+    return line + "/>\n"
+
+
+def _write_lines(xml_file, template, columns, start, stop):
+    for begin in range(start, stop, WRITE_BLOCK_LINES):
+        end = min(begin + WRITE_BLOCK_LINES, stop)
+        xml_file.write("".join(map(template.format, *[column[begin:end] for column in columns])))
+
+
+def _decimated_blocks(keys, blocks, profile, counts):
+    """Drops the waypoints of every block that profile.tolerance allows, keeping block ends.
+
+    counts["dropped"] is increased by the number of waypoints dropped.
+    """
+    import numpy as np
+    from line_fitting_helpers.decimation import decimate
+    position = [keys.index(key) for key in ("x", "y", "z") if key in keys]
+    for block in blocks:
+        points = np.array([block[k] for k in position], dtype=float).T
+        yaw = None
+        if profile.yaw_tolerance is not None and "yaw" in keys:
+            yaw = np.array(block[keys.index("yaw")], dtype=float)
+        keep = decimate(points, profile.tolerance, yaw, profile.yaw_tolerance)
+        counts["dropped"] += int(len(keep) - keep.sum())
+        yield [list(itertools.compress(column, keep)) for column in block]
+
+
+def _read_scenario(csv_filename1, csv_filename2, engine="auto", name="ControlAssessment", profile=None):
+    """Reads the head of a scenario.
 
-def all_csv_to_xml(csv_filename1,csv_filename2,xml_filename):
-    dr = pd.read_csv(csv_filename2)    #route
-    map_ = dr.iloc[len(dr)-1][dr.keys()[0]]
-    vehicle_ = dr.iloc[len(dr)-1][dr.keys()[1]]
-    mode_ = dr.iloc[len(dr)-1][dr.keys()[2]]
+    Returns the xml up to the opening <route> tag, the waypoint line template, the
+    iterator over the waypoint column blocks and the {"waypoints", "dropped"} counts
+    _write_scenario fills in.
+    """
+    route_keys, (map_, vehicle_, mode_), route_blocks = _read_route(csv_filename2, engine)    #route
+    if profile is not None:
+        route_blocks = (profile.format_columns(route_keys, block) for block in route_blocks)
+    first_block = next(route_blocks, None)
+    counts = {"waypoints": 0, "dropped": 0}
+
+    head = "\t<scenario name=\"{}\" type=\"ControlAssessment\" town=\"{}\">\n".format(name, map_)
+    head += "\t\t<ego_vehicle"
+    if first_block is not None:
+        for key, column in zip(route_keys, first_block):
+            head += " {}=\"{}\"".format(key, column[0])
+        route_blocks = itertools.chain([first_block], route_blocks)
+    head += " {}=\"{}\"/>\n".format("model",vehicle_)
     if mode_ == "with_obstacle":
-        do = pd.read_csv(csv_filename1)    #obstacle
-    
-    with open(xml_filename,'w') as xml_file:
+        object_keys, object_columns = _read_columns(csv_filename1, engine)    #obstacle
+        if profile is not None:
+            object_columns = profile.format_columns(object_keys, object_columns)
+        object_keys = ["model" if key == "object_name" else key for key in object_keys]
+        object_template = _line_template("/t/t<object", object_keys)
+        head += "".join(map(object_template.format, *object_columns))
+    head += "\t\t<route>\n"
+    if profile is not None and profile.tolerance is not None:
+        route_blocks = _decimated_blocks(route_keys, route_blocks, profile, counts)
+    return head, _line_template("\t\t\t<waypoint", route_keys), route_blocks, counts
+
+
+def _write_scenario(xml_file, scenario):
+    head, waypoint_template, route_blocks, counts = scenario
+    xml_file.write(head)
+    for block in route_blocks:
+        _write_lines(xml_file, waypoint_template, block, 0, len(block[0]))
+        counts["waypoints"] += len(block[0])
+    xml_file.write("\t\t</route>\n\t</scenario>\n")
+    return counts
+
+
+def _open_output(xml_filename, profile=None):
+    """Opens xml_filename for writing text, through gzip when the profile asks for it or the name ends with .gz."""
+    if (profile is not None and profile.compress) or xml_filename.endswith(".gz"):
+        import gzip
+        return gzip.open(xml_filename, "wt" if sys.version_info[0] >= 3 else "w")
+    return open(xml_filename, 'w')
+
 
+def all_csv_to_xml(csv_filename1,csv_filename2,xml_filename,engine="auto",profile=None):
+    """Converts an obstacle csv and a route csv (or binary route) into a scenario_runner xml file.
+
+    Returns the number of waypoints written and the number dropped by profile.
+    """
+    scenario = _read_scenario(csv_filename1, csv_filename2, engine, profile=profile)
+    with _open_output(xml_filename, profile) as xml_file:
         xml_file.write("<?xml version=\"1.0\"?>\n<scenarios>\n")
-        line1 = "\t<scenario name=\"ControlAssessment\" type=\"ControlAssessment\" town=\"{}\">\n".format(str(map_))
-        xml_file.write(line1)
-        line2 = "\t\t<ego_vehicle"
-        for key in dr.keys():
-            if len(dr) > 1:
-                number =dr.iloc[0][key]
-                line2 += " {}=\"{}\"".format(key, str(number)) 
-        line2 += " {}=\"{}\"/>\n".format("model",str(vehicle_)) 
-        xml_file.write(line2)
-        if mode_ == "with_obstacle":
-            for i in range(len(do)):
-                line = "/t/t<object"
-                for key in do.keys():
-                    number = do.iloc[i][key]
-                    if key == "object_name":
-                        line += " {}=\"{}\"".format("model", str(number))
-                    else:
-                        line += " {}=\"{}\"".format(key, str(number))
-                line += "/>\n"
-                xml_file.write(line)
-        xml_file.write("\t\t<route>\n")
-        for i in range(len(dr)-1):
-            line = "\t\t\t<waypoint"
-            for key in dr.keys():
-                number = dr.iloc[i][key]
-                line += " {}=\"{}\"".format(key, str(number))
-            line += "/>\n"
-            xml_file.write(line)
-        xml_file.write("\t\t</route>\n")
-        xml_file.write("\t</scenario>\n</scenarios>")
+        counts = _write_scenario(xml_file, scenario)
+        xml_file.write("</scenarios>")
+    return counts["waypoints"], counts["dropped"]
 
 
+def scenario_name(route_filename):
+    """Default bundle scenario name of a route file: its base name without extension and _routes suffix."""
+    name = os.path.splitext(os.path.basename(route_filename))[0]
+    return name[:-len("_routes")] if name.endswith("_routes") and len(name) > len("_routes") else name
 
 
-        
-if __name__ == "__main__":
-    assert(len(sys.argv) == 4)
-    input_name_obstacle = sys.argv[1]
-    input_name_routes = sys.argv[2]
-    output_name = sys.argv[3]
+def bundle_csv_to_xml(sources, xml_filename, engine="auto", profile=None, failures=None):
+    """Writes many scenarios into one <scenarios> document.
+
+    sources yields (obstacle csv, route csv) or (obstacle csv, route csv, name) tuples, the name
+    defaults to scenario_name(route csv). Names are made unique by appending _2, _3, ...
+    Scenarios are read and written one at a time, so memory is that of the largest scenario
+    (bounded with the "stream" engine). The document is written to a temporary file renamed
+    to xml_filename once complete, a failure leaves no partial bundle behind.
+
+    Without failures the first failing source raises. With a list, every scenario is first
+    written to a temporary file of its own, a failing source is skipped and its (source,
+    seconds, error) appended to failures. Returns the list of scenario names written.
+    """
+    import shutil
+    from xml.sax.saxutils import escape
+    if xml_filename.endswith(".gz") and not (profile is not None and profile.compress):
+        import copy
+        profile = copy.copy(profile or OutputProfile())
+        profile.compress = True
+    names = []
+    used = set()
+    temporary_filename = "{}.{}.tmp".format(xml_filename, os.getpid())
+    scenario_filename = "{}.{}.scenario.tmp".format(xml_filename, os.getpid())
+    try:
+        with _open_output(temporary_filename, profile) as xml_file:
+            xml_file.write("<?xml version=\"1.0\"?>\n<scenarios>\n")
+            for source in sources:
+                name = source[2] if len(source) > 2 else scenario_name(source[1])
+                unique, suffix = name, 1
+                while unique in used:
+                    suffix += 1
+                    unique = "{}_{}".format(name, suffix)
+                escaped = escape(unique, {"\"": "&quot;"})
+                if failures is None:
+                    _write_scenario(xml_file, _read_scenario(source[0], source[1], engine, escaped, profile))
+                else:
+                    start = time.time()
+                    try:
+                        with open(scenario_filename, "w") as scenario_file:
+                            _write_scenario(scenario_file, _read_scenario(source[0], source[1], engine, escaped, profile))
+                    except Exception as e:
+                        failures.append((source, time.time() - start, "{}: {}".format(type(e).__name__, e)))
+                        continue
+                    with open(scenario_filename) as scenario_file:
+                        shutil.copyfileobj(scenario_file, xml_file)
+                used.add(unique)
+                names.append(unique)
+            xml_file.write("</scenarios>")
+        getattr(os, "replace", os.rename)(temporary_filename, xml_filename)
+    finally:
+        for filename in (temporary_filename, scenario_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+    return names
+
+
+def stream_csv_to_xml(csv_filename1, csv_filename2, xml_filename, profile=None):
+    """all_csv_to_xml with the "stream" engine, memory stays bounded for any route length."""
+    return all_csv_to_xml(csv_filename1, csv_filename2, xml_filename, "stream", profile)
+
+
+def read_route_metadata(csv_filename):
+    """Returns the (town, vehicle, mode) fields of the last line of a route csv.
+
+    Only the end of the file is read, binary routes return the fields of their header.
+    """
+    if _is_binary_route(csv_filename):
+        from line_fitting_helpers import binary_routes
+        header = binary_routes.read_route_header(csv_filename)
+        return str(header["town"]), str(header["vehicle"]), str(header["mode"])
+    import csv
+    with open(csv_filename, "rb") as csv_file:
+        csv_file.seek(0, os.SEEK_END)
+        position = csv_file.tell()
+        block = b""
+        while position > 0 and b"\n" not in block.rstrip(b"\r\n"):
+            step = min(4096, position)
+            position -= step
+            csv_file.seek(position)
+            block = csv_file.read(step) + block
+    lines = block.rstrip(b"\r\n").splitlines()
+    if not lines:
+        raise ValueError("{} is empty".format(csv_filename))
+    fields = next(csv.reader([lines[-1].decode("utf-8")]))
+    if len(fields) < 3:
+        raise ValueError("last line of {} is not a <town>,<vehicle>,<mode> metadata row".format(csv_filename))
+    return fields[0], fields[1], fields[2]
+
+
+def _hash_file(digest, filename):
+    with open(filename, "rb") as input_file:
+        for block in iter(lambda: input_file.read(1 << 20), b""):
+            digest.update(block)
+
+
+def scenario_cache_key(csv_filename1, csv_filename2, profile=None):
+    """Returns the hex digest identifying the xml all_csv_to_xml writes for these csv files and profile.
+
+    The obstacle file only takes part when the route metadata row asks for obstacles.
+    """
+    import hashlib
+    town, vehicle, mode = read_route_metadata(csv_filename2)
+    digest = hashlib.sha1()
+    digest.update("version={}\ntown={}\nvehicle={}\nmode={}\n{}".format(
+        XML_FORMAT_VERSION, town, vehicle, mode, (profile or OutputProfile()).key()).encode("utf-8"))
+    _hash_file(digest, csv_filename2)
+    if mode == "with_obstacle":
+        digest.update(b"\nobstacles\n")
+        _hash_file(digest, csv_filename1)
+    return digest.hexdigest()
+
+
+def _install_cached(cached_filename, xml_filename, link):
+    import filecmp
+    import shutil
+    if os.path.exists(xml_filename):
+        if os.path.samefile(cached_filename, xml_filename) or filecmp.cmp(cached_filename, xml_filename, shallow=False):
+            return "unchanged"
+        os.remove(xml_filename)
+    if link:
+        try:
+            os.link(cached_filename, xml_filename)
+            return "linked"
+        except OSError:
+            pass
+    shutil.copyfile(cached_filename, xml_filename)
+    return "copied"
+
+
+def cached_csv_to_xml(csv_filename1, csv_filename2, xml_filename, engine="auto", cache_dir=None, link=False,
+                      profile=None):
+    """all_csv_to_xml through a cache of generated xml files keyed by scenario_cache_key.
+
+    On a cache hit the cached file is copied (or hard linked when link is set) to
+    xml_filename, nothing is written when xml_filename already holds the same content.
+    Returns "converted", "copied", "linked" or "unchanged", and the counts returned by
+    all_csv_to_xml when converted (None otherwise).
+    """
+    if xml_filename.endswith(".gz") and not (profile is not None and profile.compress):
+        import copy
+        profile = copy.copy(profile or OutputProfile())
+        profile.compress = True
+    cache_dir = cache_dir or os.environ.get(XML_CACHE_ENV) or XML_CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    cached_filename = os.path.join(cache_dir, scenario_cache_key(csv_filename1, csv_filename2, profile) + ".xml")
+    if os.path.exists(cached_filename):
+        return _install_cached(cached_filename, xml_filename, link), None
+    temporary_filename = "{}.{}.tmp".format(cached_filename, os.getpid())
+    try:
+        counts = all_csv_to_xml(csv_filename1, csv_filename2, temporary_filename, engine, profile)
+        os.rename(temporary_filename, cached_filename)
+    finally:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+    _install_cached(cached_filename, xml_filename, link)
+    return "converted", counts
+
+
+def read_manifest(manifest):
+    """Returns the (obstacle csv, route csv, output xml) triples of a manifest file or a directory."""
+    if os.path.isdir(manifest):
+        import glob
+        jobs = []
+        for route_csv in sorted(glob.glob(os.path.join(manifest, "*_routes.csv"))):
+            name = os.path.basename(route_csv)[:-len("_routes.csv")]
+            jobs.append((os.path.join(manifest, name + "_config.csv"), route_csv, name + ".xml"))
+        return jobs
+    base = os.path.dirname(os.path.abspath(manifest))
+    jobs = []
+    with open(manifest) as manifest_file:
+        for line in manifest_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = [field.strip() for field in line.split(",")]
+            if len(fields) != 3:
+                raise ValueError("manifest line should be <obstacle csv>,<route csv>,<output xml>: {}".format(line))
+            jobs.append((os.path.join(base, fields[0]), os.path.join(base, fields[1]), fields[2]))
+    return jobs
+
+
+def _convert_job(job, engine="auto", use_cache=False, cache_dir=None, profile=None):
+    obstacle_csv, route_csv, xml_filename = job
+    start = time.time()
+    status = counts = None
+    try:
+        if use_cache:
+            status, counts = cached_csv_to_xml(obstacle_csv, route_csv, xml_filename, engine, cache_dir, profile=profile)
+        else:
+            counts = all_csv_to_xml(obstacle_csv, route_csv, xml_filename, engine, profile)
+            status = "converted"
+        error = None
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    return xml_filename, time.time() - start, error, status, counts
+
+
+def _report(status, seconds, xml_filename, counts=None, error=None):
+    if error is not None:
+        print("{:9} {:8.3f}s {} ({})".format("FAILED", seconds, xml_filename, error))
+    elif counts is not None and counts[1]:
+        print("{:9} {:8.3f}s {} (dropped {} of {} waypoints)".format(
+            status, seconds, xml_filename, counts[1], counts[0] + counts[1]))
+    else:
+        print("{:9} {:8.3f}s {}".format(status, seconds, xml_filename))
+
+
+def batch_csv_to_xml(jobs, processes=None, chunksize=1, engine="auto", use_cache=False, cache_dir=None,
+                     profile=None):
+    """Converts (obstacle csv, route csv, output xml) triples in a process pool.
+
+    A failing job does not stop the others. Returns one (output xml, seconds, error, status,
+    counts) tuple per job in completion order, error is None on success, status and counts
+    are the values returned by cached_csv_to_xml, or "converted" and the all_csv_to_xml
+    counts without use_cache.
+    """
+    convert = functools.partial(_convert_job, engine=engine, use_cache=use_cache, cache_dir=cache_dir,
+                                profile=profile)
+    if processes == 1:
+        results = map(convert, jobs)
+        pool = None
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(convert, jobs, chunksize)
+    try:
+        done = []
+        for xml_filename, seconds, error, status, counts in results:
+            _report(status, seconds, xml_filename, counts, error)
+            done.append((xml_filename, seconds, error, status, counts))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return done
+
+
+def configs_dir(override=None):
+    """Returns the scenario_runner configs directory, ending with a slash.
+
+    override and $SCENARIO_RUNNER_CONFIGS win over the path cached in CONFIGS_DIR_CACHE,
+    RosPack is only asked when neither is set and the cache is missing or stale.
+    """
+    path = override or os.environ.get(CONFIGS_DIR_ENV)
+    if path:
+        return os.path.join(path, "")
+    try:
+        with open(CONFIGS_DIR_CACHE) as cache_file:
+            path = cache_file.read().strip()
+        if os.path.isdir(path):
+            return path
+    except (IOError, OSError):
+        pass
+    from rospkg import RosPack
     rp = RosPack()
     path = rp.get_path('carla_scenario_runner_ros')
     path += "/src/carla_scenario_runner_ros/srunner/configs/"
-    output_name = path + output_name
-    all_csv_to_xml(input_name_obstacle,input_name_routes,output_name)
+    try:
+        if not os.path.isdir(os.path.dirname(CONFIGS_DIR_CACHE)):
+            os.makedirs(os.path.dirname(CONFIGS_DIR_CACHE))
+        with open(CONFIGS_DIR_CACHE, "w") as cache_file:
+            cache_file.write(path)
+    except (IOError, OSError):
+        pass
+    return path
+
+
+def _with_suffix(filename, suffix):
+    return filename if filename.endswith(suffix) else filename + suffix
 
 
+def main(argv):
+    parser = argparse.ArgumentParser(description="convert designer csv files to scenario_runner xml")
+    parser.add_argument("files", nargs="*", metavar="FILE",
+                        help="<input csv obstacle file> <input csv route file> <output xml file>")
+    parser.add_argument("--batch", metavar="MANIFEST",
+                        help="manifest csv or directory of <name>_routes.csv/<name>_config.csv pairs")
+    parser.add_argument("--bundle", metavar="OUTPUT",
+                        help="write every scenario of --batch into this one xml file")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="number of worker processes for --batch (default: one per cpu)")
+    parser.add_argument("--configs-dir", default=None,
+                        help="output directory (default: ${} or the carla_scenario_runner_ros configs)".format(CONFIGS_DIR_ENV))
+    parser.add_argument("--engine", choices=ENGINES, default="auto",
+                        help="csv reader, auto uses the csv module for small files, pandas for large ones "
+                             "and streams very large routes")
+    parser.add_argument("--cache-dir", default=None,
+                        help="xml cache directory (default: ${} or {})".format(XML_CACHE_ENV, XML_CACHE_DIR))
+    parser.add_argument("--no-cache", action="store_true", help="always convert, bypassing the xml cache")
+    parser.add_argument("--tolerance", type=float, default=None, metavar="METRES",
+                        help="drop waypoints within this distance of the decimated route")
+    parser.add_argument("--yaw-tolerance", type=float, default=None, metavar="DEGREES",
+                        help="with --tolerance, also keep the heading within this many degrees "
+                             "(default: {})".format(DEFAULT_YAW_TOLERANCE))
+    parser.add_argument("--precision", type=int, default=None, metavar="DECIMALS",
+                        help="decimals written for x, y and z (default: as in the csv)")
+    parser.add_argument("--angle-precision", type=int, default=None, metavar="DECIMALS",
+                        help="decimals written for yaw, pitch and roll (default: as in the csv)")
+    parser.add_argument("--compact", action="store_true",
+                        help="shortcut for --precision {0} --angle-precision {0}".format(COMPACT_PRECISION))
+    parser.add_argument("--gzip", action="store_true", help="write gzip compressed xml, adding .gz to the names")
+    args = parser.parse_args(argv)
+    if args.compact:
+        args.precision = COMPACT_PRECISION if args.precision is None else args.precision
+        args.angle_precision = COMPACT_PRECISION if args.angle_precision is None else args.angle_precision
+    if args.yaw_tolerance is not None and args.tolerance is None:
+        parser.error("--yaw-tolerance needs --tolerance")
+    if args.tolerance is not None and args.yaw_tolerance is None:
+        args.yaw_tolerance = DEFAULT_YAW_TOLERANCE
+    profile = OutputProfile(args.tolerance, args.yaw_tolerance, args.precision, args.angle_precision, args.gzip)
+    suffix = ".gz" if args.gzip else ""
+
+    path = configs_dir(args.configs_dir)
+    if args.batch is None:
+        if args.bundle is not None:
+            parser.error("--bundle needs --batch")
+        if len(args.files) != 3:
+            parser.error("expected <input csv obstacle file> <input csv route file> <output xml file>")
+        start = time.time()
+        xml_filename = _with_suffix(path + args.files[2], suffix)
+        if args.no_cache:
+            status, counts = "converted", all_csv_to_xml(args.files[0], args.files[1], xml_filename,
+                                                         args.engine, profile)
+        else:
+            status, counts = cached_csv_to_xml(args.files[0], args.files[1], xml_filename, args.engine,
+                                               args.cache_dir, profile=profile)
+        _report(status, time.time() - start, xml_filename, counts)
+        return 0
+    if args.files:
+        parser.error("positional files cannot be combined with --batch")
+    if args.bundle is not None:
+        start = time.time()
+        sources = [(obstacle_csv, route_csv, os.path.splitext(xml_filename)[0])
+                   for obstacle_csv, route_csv, xml_filename in read_manifest(args.batch)]
+        xml_filename = _with_suffix(path + args.bundle, suffix)
+        failures = []
+        names = bundle_csv_to_xml(sources, xml_filename, args.engine, profile, failures)
+        for source, seconds, error in failures:
+            _report(None, seconds, source[1], error=error)
+        print("bundled {} scenarios into {} in {:.3f}s, {} failed".format(
+            len(names), xml_filename, time.time() - start, len(failures)))
+        return 1 if failures else 0
+
+    jobs = [(obstacle_csv, route_csv, _with_suffix(path + xml_filename, suffix))
+            for obstacle_csv, route_csv, xml_filename in read_manifest(args.batch)]
+    start = time.time()
+    results = batch_csv_to_xml(jobs, args.processes, engine=args.engine,
+                               use_cache=not args.no_cache, cache_dir=args.cache_dir, profile=profile)
+    failures = [result for result in results if result[2] is not None]
+    converted = [result for result in results if result[3] == "converted"]
+    print("{} of {} scenarios done in {:.3f}s, {} converted, {} failed".format(
+        len(results) - len(failures), len(results), time.time() - start, len(converted), len(failures)))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -46,6 +46,7 @@ import weakref
 
 import numpy as np
 from line_fitting_helpers import catmull_rom_spline as cftool
+from line_fitting_helpers import binary_routes
 
 
 try:
@@ -742,25 +743,26 @@ class RoutesManager(object):
         self.object_name = "static.prop.wateringcan"
         self.config_file = ROUTES_FILE
         self.debugcolor = carla.Color(r=0,b=0,g=0)
-        self.res = 8   
+        # metres between interpolated route waypoints
+        self.spacing = 2.0
         
     
     def fit_routes(self):
         if len(self.waypoints_transforms) > 0:
-            waypoints_transform_x = []
-            waypoints_transform_y = []
-            for i in range(len(self.waypoints_transforms)):
-                waypoints_transform_x.append(self.waypoints_transforms[i].location.x)
-                waypoints_transform_y.append(self.waypoints_transforms[i].location.y)
-            x, y = cftool.catmull_rom(waypoints_transform_x, waypoints_transform_y,self.res)
-            transform = []
-            for j in range(len(x)):
+            # elevation and rotation come from the control waypoints, so the
+            # interpolated points need no get_waypoint call each
+            controls = np.array([(transform.location.x, transform.location.y, transform.location.z,
+                                  transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll)
+                                 for transform in self.waypoints_transforms], dtype=float)
+            intpol = cftool.catmull_rom_spaced(controls, self.spacing, angles=(3, 4, 5))
+            for x, y, z, pitch, yaw, roll in intpol:
                 transform = carla.Transform()
-                transform.location.x = x[j]
-                transform.location.y = y[j]
-                zwischen_waypoint = self.map.get_waypoint(transform.location,project_to_road = True, lane_type = carla.LaneType.Driving)
-                transform.location.z = zwischen_waypoint.transform.location.z
-                transform.rotation = zwischen_waypoint.transform.rotation
+                transform.location.x = x
+                transform.location.y = y
+                transform.location.z = z
+                transform.rotation.pitch = pitch
+                transform.rotation.yaw = yaw
+                transform.rotation.roll = roll
                 self.waypoints_interpolate_transforms.append(transform)
                 self.debuger.draw_point(transform.location,size = 0.07, life_time = 36000.0)        
             for j in range(len(self.waypoints_interpolate_transforms)):
@@ -799,6 +801,7 @@ class RoutesManager(object):
             output_transform = object_.get_transform()
             your_now_waypoint = self.map.get_waypoint(output_transform.location,project_to_road = True, lane_type = carla.LaneType.Driving)
             output_transform.location.z = your_now_waypoint.transform.location.z
+            output_transform.rotation = your_now_waypoint.transform.rotation
             self.debuger.draw_point(output_transform.location,size = 0.15,color=self.debugcolor, life_time = 36000.0)
             if your_now_waypoint is not None:
                 self.waypoints_transforms.append(output_transform)
@@ -835,20 +838,25 @@ class RoutesManager(object):
 
 
     def save_routes_configure(self):
-        with open(self.config_file, "w") as my_file:
-            lines = []
-            init_text = "x,y,z,yaw\n"
-            my_file.write(init_text)
-            for transform in self.waypoints_interpolate_transforms:
-                x = transform.location.x
-                y = transform.location.y
-                z = transform.location.z
-                yaw = transform.rotation.yaw
-                text = "{},{},{},{}\n".format(
-                    str(x), str(y), str(z),  str(yaw) 
-                )
-                lines.append(text)
-            my_file.writelines(lines)
+        if self.config_file.endswith(binary_routes.ROUTE_EXTENSION):
+            waypoints = np.array([(transform.location.x, transform.location.y, transform.location.z, transform.rotation.yaw)
+                                  for transform in self.waypoints_interpolate_transforms], dtype=float).reshape(-1, 4)
+            binary_routes.write_route(self.config_file, waypoints)
+        else:
+            with open(self.config_file, "w") as my_file:
+                lines = []
+                init_text = "x,y,z,yaw\n"
+                my_file.write(init_text)
+                for transform in self.waypoints_interpolate_transforms:
+                    x = transform.location.x
+                    y = transform.location.y
+                    z = transform.location.z
+                    yaw = transform.rotation.yaw
+                    text = "{},{},{},{}\n".format(
+                        str(x), str(y), str(z),  str(yaw) 
+                    )
+                    lines.append(text)
+                my_file.writelines(lines)
 
         self.hud.notification("save {} ROUTES config in {}".format(
             str(len(self.waypoints_interpolate_transforms)), self.config_file))
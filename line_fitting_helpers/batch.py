@@ -0,0 +1,129 @@
+""" Fitting many polylines at once
+
+    fit_many runs one of the fitting methods below over an iterable of point
+    arrays, in a process pool or serially, and returns one (result, seconds,
+    error) tuple per polyline in input order:
+
+    bezier       fitCurve(points, max_error), a list of control polygons
+    bspline      bspline_planning(points, sn), an (sn, 2) array of samples,
+                 (0, 2) for 4 or fewer points
+    catmull_rom  catmull_rom(x, y, res), an (n, 2) array of samples
+
+    e.g. fit_many(routes, "bezier", max_error=4.0, processes=8)
+
+    check every method on synthetic routes, serially and in a pool, with
+    python -m line_fitting_helpers.batch [number of routes]
+"""
+from __future__ import print_function
+import functools
+import time
+import numpy as np
+
+METHODS = ("bezier", "bspline", "catmull_rom")
+DEFAULT_PARAMS = {
+    "bezier": {"max_error": 4.0},
+    "bspline": {"sn": 100},
+    "catmull_rom": {"res": 8},
+}
+# chunks per worker when no chunksize is given, as multiprocessing.Pool.map does
+CHUNKS_PER_PROCESS = 4
+
+
+def _fit_bezier(points, max_error):
+    from line_fitting_helpers.fitCurves import fitCurve
+    return fitCurve(points, max_error)
+
+
+def _fit_bspline(points, sn):
+    from line_fitting_helpers.bspline_path import bspline_planning
+    return bspline_planning(points, sn)
+
+
+def _fit_catmull_rom(points, res):
+    from line_fitting_helpers.catmull_rom_spline import catmull_rom
+    return np.column_stack(catmull_rom(points[:, 0], points[:, 1], res))
+
+
+_FITTERS = {
+    "bezier": _fit_bezier,
+    "bspline": _fit_bspline,
+    "catmull_rom": _fit_catmull_rom,
+}
+
+
+def _fit_item(points, method, params):
+    start = time.time()
+    try:
+        result = _FITTERS[method](np.asarray(points, dtype=float), **params)
+        error = None
+    except Exception as e:
+        result = None
+        error = "{}: {}".format(type(e).__name__, e)
+    return result, time.time() - start, error
+
+
+def fit_many(polylines, method="bezier", processes=None, chunksize=None, **params):
+    """Fits every polyline with method, see the module docstring.
+
+    processes=1 fits serially in this process, so does a batch of fewer than two
+    polylines or a platform where no pool can be started. A failing polyline does
+    not stop the others, its result is None and error names the exception.
+    """
+    if method not in _FITTERS:
+        raise ValueError("unknown fitting method {!r}, expected one of {}".format(method, ", ".join(METHODS)))
+    fit_params = dict(DEFAULT_PARAMS[method])
+    fit_params.update(params)
+    fit = functools.partial(_fit_item, method=method, params=fit_params)
+
+    polylines = list(polylines)
+    if processes == 1 or len(polylines) < 2:
+        return list(map(fit, polylines))
+    try:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+    except (ImportError, OSError, NotImplementedError):
+        return list(map(fit, polylines))
+    try:
+        if chunksize is None:
+            chunks = (processes or multiprocessing.cpu_count()) * CHUNKS_PER_PROCESS
+            chunksize = max(1, -(-len(polylines) // chunks))
+        return list(pool.imap(fit, polylines, chunksize))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def timing_summary(results):
+    """Count, failures and total/mean/max seconds of fit_many results."""
+    seconds = np.array([item[1] for item in results], dtype=float)
+    return {
+        "count": len(results),
+        "failed": sum(1 for item in results if item[2] is not None),
+        "total": float(seconds.sum()),
+        "mean": float(seconds.mean()) if len(seconds) else 0.0,
+        "max": float(seconds.max()) if len(seconds) else 0.0,
+    }
+
+
+def main(n_routes=64):
+    """Fits n_routes synthetic routes with every method, returns 1 if any fit fails."""
+    x = np.linspace(0.0, 200.0, 100)
+    routes = [np.column_stack((x, (5.0 + i) * np.sin(x / (20.0 + i)))) for i in range(n_routes)]
+    failed = 0
+    for method in METHODS:
+        for processes in (1, None):
+            results = fit_many(routes, method, processes=processes)
+            summary = timing_summary(results)
+            print("{:12} processes={:4} {count} fitted, {failed} failed, {total:.3f}s total, {max:.4f}s max".format(
+                method, str(processes), **summary))
+            for result, _, error in results:
+                if error is not None:
+                    print("  " + error)
+                    break
+            failed += summary["failed"]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:2]]))
@@ -17,3 +17,75 @@ def qprimeprime(ctrlPoly, t):
     return 6*(1.0-t) * (ctrlPoly[2]-2*ctrlPoly[1]+ctrlPoly[0]) + 6*(t) * (ctrlPoly[3]-2*ctrlPoly[2]+ctrlPoly[1])
 
 
+# Bernstein basis matrices, keyed by (samples, derivative)
+_basisCache = {}
+
+
+def bernsteinBasis(t, derivative=0):
+    """ (len(t), 4) matrix whose rows weight the four control points of a
+        cubic bezier (or of its first/second derivative) at each t """
+    t = asarray(t, dtype=float)
+    s = 1.0 - t
+    if derivative == 0:
+        columns = [s**3, 3*s**2 * t, 3*s * t**2, t**3]
+    elif derivative == 1:
+        columns = [-3*s**2, 3*s**2 - 6*s*t, 6*s*t - 3*t**2, 3*t**2]
+    elif derivative == 2:
+        columns = [6*s, 6*t - 12*s, 6*s - 12*t, 6*t]
+    else:
+        raise ValueError("derivative must be 0, 1 or 2, got {}".format(derivative))
+    return stack(columns, axis=-1)
+
+
+def sampledBasis(samples, derivative=0):
+    """ cached basis for samples evenly spaced t in [0, 1] """
+    key = (int(samples), derivative)
+    basis = _basisCache.get(key)
+    if basis is None:
+        basis = bernsteinBasis(linspace(0.0, 1.0, key[0]), derivative)
+        basis.setflags(write=False)
+        _basisCache[key] = basis
+    return basis
+
+
+# evaluates one (4, dim) or many (n_curves, 4, dim) cubic beziers at a
+# vector of t, or at samples evenly spaced t using a cached basis
+def evaluate(ctrlPolys, t=None, samples=None, derivative=0):
+    if (t is None) == (samples is None):
+        raise ValueError("pass exactly one of t or samples")
+    basis = sampledBasis(samples, derivative) if t is None else bernsteinBasis(t, derivative)
+    return matmul(basis, asarray(ctrlPolys, dtype=float))
+
+
+# samples a chain of beziers into one polyline, dropping the repeated joints
+def evaluateChain(beziers, samples):
+    curves = evaluate(array(beziers, dtype=float), samples=samples)
+    if len(curves) == 0:
+        return curves.reshape(0, curves.shape[-1])
+    return concatenate([curves[0]] + [c[1:] for c in curves[1:]])
+
+
+# samples a chain of beziers at a fixed arc-length spacing. The arc length
+# is tabulated from lookupSamples points per curve; each output point is then
+# evaluated exactly on its curve at the interpolated t. The chain end is
+# always kept, so the last gap may be shorter than spacing.
+def resampleChain(beziers, spacing, lookupSamples=64):
+    if not spacing > 0:
+        raise ValueError("spacing must be positive, got {}".format(spacing))
+    ctrlPolys = array(beziers, dtype=float)
+    if len(ctrlPolys) == 0:
+        return ctrlPolys.reshape(0, ctrlPolys.shape[-1])
+
+    # chain parameter c = curve index + t, tabulated against arc length
+    dense = evaluate(ctrlPolys, samples=lookupSamples)
+    steps = sqrt((diff(dense, axis=1)**2).sum(axis=2)).ravel()
+    table = concatenate(([0.0], cumsum(steps)))
+    tableT = linspace(0.0, 1.0, lookupSamples)[1:]
+    param = concatenate(([0.0], (arange(len(ctrlPolys))[:, newaxis] + tableT).ravel()))
+
+    targets = arange(0.0, table[-1], spacing)
+    if len(targets) == 0 or targets[-1] < table[-1]:
+        targets = append(targets, table[-1])
+    c = interp(targets, table, param)
+    curve = minimum(c.astype(int), len(ctrlPolys) - 1)
+    return einsum('mk,mkd->md', bernsteinBasis(c - curve), ctrlPolys[curve])
@@ -0,0 +1,102 @@
+""" Binary route files
+
+    A route file starts with the 8 byte MAGIC, a little endian uint32 giving the
+    length of a json header (town, vehicle, mode and the waypoint count), the header
+    itself padded with spaces to a multiple of 64 bytes, then the waypoints as raw
+    ROUTE_DTYPE records. load_route maps the records with np.memmap, so nothing is
+    parsed and only the pages actually used are read.
+
+    convert a route csv with
+    python -m line_fitting_helpers.binary_routes <input csv route file> <output route file>
+"""
+from __future__ import print_function
+import json
+import struct
+import numpy as np
+
+MAGIC = b"\x93SDROUTE"
+VERSION = 1
+ROUTE_EXTENSION = ".route"
+ROUTE_DTYPE = np.dtype([("x", "<f8"), ("y", "<f8"), ("z", "<f8"), ("yaw", "<f8")])
+
+
+def is_binary_route(filename):
+    with open(filename, "rb") as route_file:
+        return route_file.read(len(MAGIC)) == MAGIC
+
+
+def write_route(filename, waypoints, town=None, vehicle=None, mode=None):
+    """Writes waypoints, a ROUTE_DTYPE array or an (n, 4) array of x, y, z, yaw."""
+    waypoints = np.asarray(waypoints)
+    if waypoints.dtype.names is None:
+        waypoints = np.ascontiguousarray(waypoints, dtype="<f8").reshape(-1, len(ROUTE_DTYPE.names)).view(ROUTE_DTYPE)[:, 0]
+    else:
+        waypoints = np.ascontiguousarray(waypoints.astype(ROUTE_DTYPE))
+    header = {"version": VERSION, "count": len(waypoints), "fields": list(ROUTE_DTYPE.names),
+              "town": town, "vehicle": vehicle, "mode": mode}
+    header = json.dumps(header, sort_keys=True).encode("utf-8")
+    prefix = len(MAGIC) + 4
+    header += b" " * (-(prefix + len(header)) % 64)
+    with open(filename, "wb") as route_file:
+        route_file.write(MAGIC + struct.pack("<I", len(header)) + header)
+        route_file.write(waypoints.tobytes())
+
+
+def read_route_header(filename):
+    """Returns the json header of a route file, with the byte offset of the records added as "offset"."""
+    with open(filename, "rb") as route_file:
+        if route_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a binary route file".format(filename))
+        (length,) = struct.unpack("<I", route_file.read(4))
+        header = json.loads(route_file.read(length).decode("utf-8"))
+    if header["version"] > VERSION:
+        raise ValueError("{} has route format version {}, newer than {}".format(filename, header["version"], VERSION))
+    header["offset"] = len(MAGIC) + 4 + length
+    return header
+
+
+def load_route(filename):
+    """Returns the waypoints of a route file as a read-only memory-mapped ROUTE_DTYPE array, and its header."""
+    header = read_route_header(filename)
+    if header["count"] == 0:
+        return np.zeros(0, dtype=ROUTE_DTYPE), header
+    waypoints = np.memmap(filename, dtype=ROUTE_DTYPE, mode="r", offset=header["offset"], shape=(header["count"],))
+    return waypoints, header
+
+
+def route_array(waypoints, fields=("x", "y")):
+    """Returns an (n, len(fields)) float view of consecutive ROUTE_DTYPE fields, without copying."""
+    first = ROUTE_DTYPE.names.index(fields[0])
+    if tuple(ROUTE_DTYPE.names[first:first + len(fields)]) != tuple(fields):
+        raise ValueError("fields {} are not consecutive in {}".format(fields, ROUTE_DTYPE.names))
+    table = waypoints.view("<f8").reshape(len(waypoints), len(ROUTE_DTYPE.names))
+    return table[:, first:first + len(fields)]
+
+
+def load_route_points(filename, fields=("x", "y")):
+    """Memory-maps a route file and returns the points the fitting helpers take, see route_array."""
+    return route_array(load_route(filename)[0], fields)
+
+
+def csv_to_route(csv_filename, route_filename):
+    """Converts a route csv written by the designers, keeping its town,vehicle,mode metadata row."""
+    import csv
+    rows = []
+    metadata = (None, None, None)
+    with open(csv_filename) as csv_file:
+        reader = csv.reader(csv_file)
+        next(reader)
+        for row in reader:
+            if not row:
+                continue
+            try:
+                rows.append([float(value) for value in row[:len(ROUTE_DTYPE.names)]])
+            except ValueError:
+                metadata = tuple(row[:3])
+    write_route(route_filename, np.array(rows, dtype="<f8").reshape(-1, len(ROUTE_DTYPE.names)), *metadata)
+
+
+if __name__ == '__main__':
+    import sys
+    assert(len(sys.argv) == 3)
+    csv_to_route(sys.argv[1], sys.argv[2])
@@ -1,45 +1,90 @@
 #!/usr/bin/python3.5
 
+from collections import OrderedDict
 import numpy as np
-import matplotlib.pyplot as plt
 import scipy.interpolate as si
+from scipy.sparse import csr_matrix
 
 # parameter
 N = 3  # B Spline order
 
+BASIS_CACHE_SIZE = 32
+
+_basis_cache = OrderedDict()
+
+
+def bspline_knots(n):
+    """Knots splrep puts on t = 0..n-1, they do not depend on the values."""
+    return si.splrep(np.arange(n, dtype=float), np.zeros(n), k=N)[0]
+
+
+def bspline_basis(n, sn):
+    """Sparse (sn, n) matrix taking n control points to sn curve samples.
+
+    The knots of splrep over t = 0..n-1 and the samples at
+    np.linspace(0, n-1, sn) only depend on (n, sn), so the matrix is built
+    once and kept for the last BASIS_CACHE_SIZE shapes.
+    """
+    key = (n, sn)
+    basis = _basis_cache.pop(key, None)
+    if basis is None:
+        knots = bspline_knots(n)
+        ipl_t = np.linspace(0.0, n - 1, sn)
+        if sn < 1:
+            basis = csr_matrix((0, n))
+        elif hasattr(si.BSpline, "design_matrix"):
+            basis = si.BSpline.design_matrix(ipl_t, knots, N).tocsr()
+        else:
+            # scipy < 1.8, evaluate one unit coefficient vector per column
+            unit = np.hstack((np.eye(n), np.zeros((n, N + 1))))
+            basis = csr_matrix(np.array(si.splev(ipl_t, (knots, list(unit), N))).T)
+        while len(_basis_cache) >= BASIS_CACHE_SIZE:
+            _basis_cache.popitem(last=False)
+    _basis_cache[key] = basis
+    return basis
+
+
 def bspline_planning(points, sn):
-    x = []
-    y = []
-    for point in points:
-        x.append(point[0])
-        y.append(point[1])
-    fit_points = []
-    #print(points)
+    """(sn, 2) samples of the cubic B-spline with points as control points.
+
+    A B-spline needs more than 4 control points, fewer give a (0, 2) array.
+    """
+    points = np.asarray(points, dtype=float)
     if len(points) > 4:
-        t = range(len(x))
-        x_tup = si.splrep(t, x, k=N)
-        y_tup = si.splrep(t, y, k=N)
-        x_list = list(x_tup)
-        #xl = x.tolist()
-        x_list[1] = x + [0.0, 0.0, 0.0, 0.0]
-        y_list = list(y_tup)
-        #yl = y.tolist()
-        y_list[1] = y + [0.0, 0.0, 0.0, 0.0]
-
-        ipl_t = np.linspace(0.0, len(x) - 1, sn)
-        rx = si.splev(ipl_t, x_list)
-        ry = si.splev(ipl_t, y_list)
-        for i in range(len(rx)):
-            point = [rx[i],ry[i]]
-            fit_points.append(point)
-    else:
-        print("please continue click, you must have more than 4 points to draw a B_spline")
-    return fit_points
+        return bspline_basis(len(points), sn).dot(points)
+    print("please continue click, you must have more than 4 points to draw a B_spline")
+    return np.zeros((0, 2))
+
+
+def iter_bspline_planning(points, sn, chunk_samples=65536):
+    """Yields bspline_planning(points, sn) in chunks of chunk_samples samples.
+
+    Besides the control points only one chunk is held in memory, the sample
+    parameters of a chunk are computed like np.linspace computes them, so the
+    chunks concatenate to what bspline_planning returns.
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    if n <= 4:
+        yield bspline_planning(points, sn)
+        return
+    padding = np.zeros(N + 1)
+    tck_x = (bspline_knots(n), np.concatenate((points[:, 0], padding)), N)
+    tck_y = (tck_x[0], np.concatenate((points[:, 1], padding)), N)
+    step = (n - 1.0) / (sn - 1) if sn > 1 else 0.0
+    for start in range(0, sn, chunk_samples):
+        stop = min(start + chunk_samples, sn)
+        ipl_t = np.arange(start, stop) * step
+        if stop == sn and sn > 1:
+            ipl_t[-1] = n - 1.0
+        yield np.column_stack((si.splev(ipl_t, tck_x), si.splev(ipl_t, tck_y)))
+
 
 def main():
+    import matplotlib.pyplot as plt
     print(__file__ + " start!!")
     # way points
-    points = [[1,2],[2,3],[4,5],[5,7]]
+    points = [[1,2],[2,3],[4,5],[5,7],[7,8]]
     print(points)
     x = []
     y = []
@@ -50,7 +95,7 @@ def main():
     print(y)
     sn = 100  # sampling number
 
-    rx, ry = bspline_planning(points, sn)
+    rx, ry = bspline_planning(points, sn).T
 
     # show results
     plt.plot(x, y, '-og', label="Waypoints")
@@ -23,61 +23,243 @@ def catmull_rom_one_point(x, v0, v1, v2, v3):
     c4 = -.5 * v0 + 1.5 * v1 + -1.5 * v2 + .5 * v3
     return (((c4 * x + c3) * x + c2) * x + c1)
 
+# rows give the weights of v0..v3 in c1..c4 of catmull_rom_one_point
+CATMULL_ROM_MATRIX = np.array([
+    [0., 1., 0., 0.],
+    [-.5, 0., .5, 0.],
+    [1., -2.5, 2., -.5],
+    [-.5, 1.5, -1.5, .5]])
+
+_basis_cache = {}
+
+
+def catmull_rom_basis(res):
+    """(res, 4) weights of the four support points at res samples of a segment.
+
+    The samples are spaced like np.linspace(0., 1., res, endpoint=False). The
+    matrix is cached per res and must not be modified.
+    """
+    basis = _basis_cache.get(res)
+    if basis is None:
+        x = np.linspace(0., 1., res, endpoint=False)
+        basis = np.vander(x, 4, increasing=True).dot(CATMULL_ROM_MATRIX)
+        basis.setflags(write=False)
+        _basis_cache[res] = basis
+    return basis
+
+
 def catmull_rom(p_x, p_y, res):
     """Computes Catmull-Rom Spline for given support points and resolution.
 
+    All segments are evaluated at once: every segment's four support points
+    form one row of a window matrix, which is multiplied by the cached basis.
+    Before the first and after the last point an additional support point is
+    extrapolated linearly.
     Args:
         p_x: array of x-coords
         p_y: array of y-coords
         res: resolution of a segment (including the start point, but not the
             endpoint of the segment)
     """
-    # create arrays for spline points
-    x_intpol = np.empty(res*(len(p_x)-1) + 1)
-    y_intpol = np.empty(res*(len(p_x)-1) + 1)
+    p_x = np.asarray(p_x, dtype=float)
+    p_y = np.asarray(p_y, dtype=float)
+    n_segments = len(p_x) - 1
 
-    # set the last x- and y-coord, the others will be set in the loop
+    # x-coords are spaced linearly within each segment
+    step = (p_x[1:] - p_x[:-1]) / res
+    x_intpol = np.empty(res*n_segments + 1)
+    x_intpol[:-1] = (np.arange(res) * step[:, np.newaxis] + p_x[:-1, np.newaxis]).ravel()
     x_intpol[-1] = p_x[-1]
-    y_intpol[-1] = p_y[-1]
-
-    # loop over segments (we have n-1 segments for n points)
-    for i in range(len(p_x)-1):
-        # set x-coords
-        x_intpol[i*res:(i+1)*res] = np.linspace(
-            p_x[i], p_x[i+1], res, endpoint=False)
-        if i == 0:
-            # need to estimate an additional support point before the first
-            y_intpol[:res] = np.array([
-                catmull_rom_one_point(
-                    x,
-                    p_y[0] - (p_y[1] - p_y[0]), # estimated start point,
-                    p_y[0],
-                    p_y[1],
-                    p_y[2])
-                for x in np.linspace(0.,1.,res, endpoint=False)])
-        elif i == len(p_x) - 2:
-            # need to estimate an additional support point after the last
-            y_intpol[i*res:-1] = np.array([
-                catmull_rom_one_point(
-                    x,
-                    p_y[i-1],
-                    p_y[i],
-                    p_y[i+1],
-                    p_y[i+1] + (p_y[i+1] - p_y[i]) # estimated end point
-                ) for x in np.linspace(0.,1.,res, endpoint=False)])
-        else:
-            y_intpol[i*res:(i+1)*res] = np.array([
-                catmull_rom_one_point(
-                    x,
-                    p_y[i-1],
-                    p_y[i],
-                    p_y[i+1],
-                    p_y[i+2]) for x in np.linspace(0.,1.,res, endpoint=False)])
 
+    y_intpol = catmull_rom_nd(p_y, res)[:, 0]
 
     return (x_intpol, y_intpol)
 
 
+def wrap_degrees(angle):
+    """Wraps angles in degrees to [-180, 180)."""
+    return (np.asarray(angle) + 180.0) % 360.0 - 180.0
+
+
+def catmull_rom_nd(points, res, angles=()):
+    """Computes a Catmull-Rom Spline through (N, D) support points.
+
+    Every coordinate is interpolated with the cached basis of res, giving
+    res*(N-1) + 1 points, the last one being the last support point. The
+    columns listed in angles hold angles in degrees; they are unwrapped
+    before interpolating, so a heading going from 179 to -179 turns by 2
+    degrees and not by 358, and wrapped to [-180, 180) afterwards.
+    Args:
+        points: (N, D) array of support points, or N values
+        res: resolution of a segment (including the start point, but not the
+            endpoint of the segment)
+        angles: indices of the columns in degrees
+    """
+    points = np.array(points, dtype=float)
+    if points.ndim == 1:
+        points = points[:, np.newaxis]
+    angles = list(angles)
+    if angles:
+        points[:, angles] = np.degrees(np.unwrap(np.radians(points[:, angles]), axis=0))
+    n_segments = len(points) - 1
+    if n_segments < 1:
+        # a single support point has nothing to interpolate
+        intpol = points
+    else:
+        padded = np.concatenate((
+            [points[0] - (points[1] - points[0])], # estimated start point
+            points,
+            [points[-1] + (points[-1] - points[-2])])) # estimated end point
+        intpol = np.empty((res*n_segments + 1, points.shape[1]))
+        intpol[:-1] = _catmull_rom_windows(padded, res)
+        intpol[-1] = points[-1]
+    if angles:
+        intpol[:, angles] = wrap_degrees(intpol[:, angles])
+    return intpol
+
+
+def _catmull_rom_windows(padded, res):
+    """res points for each window of four consecutive padded support points."""
+    n_segments = len(padded) - 3
+    # windows[i] = support points v0..v3 of segment i
+    windows = np.stack([padded[k:k + n_segments] for k in range(4)], axis=1)
+    return np.matmul(catmull_rom_basis(res), windows).reshape(-1, padded.shape[1])
+
+
+def iter_catmull_rom(points, res, chunk_segments=4096, angles=()):
+    """Yields catmull_rom_nd(points, res, angles) in chunks.
+
+    Support points are read chunk_segments at a time, so points may be a
+    memory-mapped array (see binary_routes.load_route_points) that never
+    gets loaded whole, and each chunk holds about chunk_segments*res points.
+    The last three support points of a chunk, already unwrapped, are the
+    state carried into the next one: they open its first window, so the
+    chunks concatenate to what catmull_rom_nd returns, equal up to the
+    rounding of the angle unwrapping in angle columns.
+    """
+    if chunk_segments < 2:
+        raise ValueError("chunk_segments must be at least 2, got {}".format(chunk_segments))
+    angles = list(angles)
+    n_points = len(points)
+    if n_points < 2:
+        yield catmull_rom_nd(np.array(points, dtype=float).reshape(n_points, -1), res, angles)
+        return
+
+    width = np.shape(points)[1] if np.ndim(points) > 1 else 1
+    tail = None
+    for start in range(0, n_points, chunk_segments):
+        block = np.array(points[start:start + chunk_segments], dtype=float).reshape(-1, width)
+        if angles:
+            # continue unwrapping from the last angle of the previous chunk
+            previous = block[:1] if tail is None else tail[-1:]
+            unwrapped = np.unwrap(np.radians(np.concatenate((previous, block))[:, angles]), axis=0)
+            block[:, angles] = np.degrees(unwrapped[1:])
+        if tail is None:
+            tail = block[:1] - (block[1:2] - block[:1]) # estimated start point
+        padded = np.concatenate((tail, block))
+        last = start + chunk_segments >= n_points
+        if last:
+            padded = np.concatenate((padded, padded[-1:] + (padded[-1:] - padded[-2:-1]))) # estimated end point
+        chunk = _catmull_rom_windows(padded, res)
+        if last:
+            chunk = np.concatenate((chunk, padded[-2:-1]))
+        tail = padded[-3:]
+        if angles:
+            chunk[:, angles] = wrap_degrees(chunk[:, angles])
+        yield chunk
+
+
+def centripetal_knots(points, alpha=0.5):
+    """Knot intervals |P_i+1 - P_i|**alpha, 0.5 centripetal, 1 chordal.
+
+    Intervals between coincident points would divide by zero and fall back
+    to 1, the uniform spacing.
+    """
+    lengths = np.sqrt((np.diff(points, axis=0)**2).sum(axis=1))
+    intervals = lengths**alpha
+    return np.where(intervals > 1e-8, intervals, 1.)
+
+
+def _catmull_rom_at(windows, knots, u):
+    """Barry-Goldman evaluation of segment windows (M, 4, D) with knot
+    intervals knots (M, 3) at u (M,) in [0, 1] of the middle interval."""
+    t1 = knots[:, 0]
+    t2 = t1 + knots[:, 1]
+    t3 = t2 + knots[:, 2]
+    t = (t1 + u * knots[:, 1])[:, np.newaxis]
+    t1, t2, t3 = t1[:, np.newaxis], t2[:, np.newaxis], t3[:, np.newaxis]
+    p0, p1, p2, p3 = windows[:, 0], windows[:, 1], windows[:, 2], windows[:, 3]
+    a1 = ((t1 - t) * p0 + t * p1) / t1
+    a2 = ((t2 - t) * p1 + (t - t1) * p2) / (t2 - t1)
+    a3 = ((t3 - t) * p2 + (t - t2) * p3) / (t3 - t2)
+    b1 = ((t2 - t) * a1 + t * a2) / t2
+    b2 = ((t3 - t) * a2 + (t - t1) * a3) / (t3 - t1)
+    return ((t2 - t) * b1 + (t - t1) * b2) / (t2 - t1)
+
+
+def catmull_rom_spaced(points, spacing, alpha=0.5, angles=(), lookup=16):
+    """Computes a centripetal Catmull-Rom Spline sampled every spacing metres.
+
+    Knots are spaced by centripetal_knots of the distance between support
+    points, so the curve neither overshoots nor loops on unevenly clicked
+    points. The arc length is tabulated with lookup samples per segment and
+    the output points are evaluated exactly at equal arc-length steps; the
+    last support point is always kept, so the last step may be shorter.
+    Repeated support points are dropped. Distances are measured over the
+    columns not listed in angles, which are unwrapped and wrapped like in
+    catmull_rom_nd.
+    Args:
+        points: (N, D) array of support points
+        spacing: distance between output points
+        alpha: 0.5 centripetal, 1 chordal, 0 uniform
+        angles: indices of the columns in degrees
+        lookup: arc-length samples per segment
+    """
+    if not spacing > 0:
+        raise ValueError("spacing must be positive, got {}".format(spacing))
+    points = np.array(points, dtype=float)
+    if points.ndim == 1:
+        points = points[:, np.newaxis]
+    angles = list(angles)
+    metric = [column for column in range(points.shape[1]) if column not in angles]
+    if angles:
+        points[:, angles] = np.degrees(np.unwrap(np.radians(points[:, angles]), axis=0))
+    # repeated clicks would make zero length segments
+    moved = np.concatenate(([True], (np.diff(points[:, metric], axis=0) != 0).any(axis=1)))
+    points = points[moved]
+    n_segments = len(points) - 1
+    if n_segments < 1:
+        intpol = points
+    else:
+        padded = np.concatenate((
+            [points[0] - (points[1] - points[0])], # estimated start point
+            points,
+            [points[-1] + (points[-1] - points[-2])])) # estimated end point
+        windows = np.stack([padded[k:k + n_segments] for k in range(4)], axis=1)
+        intervals = centripetal_knots(padded[:, metric], alpha)
+        knots = np.stack([intervals[k:k + n_segments] for k in range(3)], axis=1)
+
+        # chain parameter c = segment + u, tabulated against arc length
+        u = np.linspace(0., 1., lookup + 1)
+        segment = np.repeat(np.arange(n_segments), lookup + 1)
+        dense = _catmull_rom_at(windows[segment], knots[segment], np.tile(u, n_segments))
+        dense = dense.reshape(n_segments, lookup + 1, -1)[:, :, metric]
+        steps = np.sqrt((np.diff(dense, axis=1)**2).sum(axis=2)).ravel()
+        table = np.concatenate(([0.], np.cumsum(steps)))
+        param = np.concatenate(([0.], (np.arange(n_segments)[:, np.newaxis] + u[1:]).ravel()))
+
+        targets = np.arange(0., table[-1], spacing)
+        if len(targets) == 0 or targets[-1] < table[-1]:
+            targets = np.append(targets, table[-1])
+        c = np.interp(targets, table, param)
+        segment = np.minimum(c.astype(int), n_segments - 1)
+        intpol = _catmull_rom_at(windows[segment], knots[segment], c - segment)
+        intpol[-1] = points[-1]
+    if angles:
+        intpol[:, angles] = wrap_degrees(intpol[:, angles])
+    return intpol
+
+
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
 
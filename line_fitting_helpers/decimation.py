@@ -0,0 +1,74 @@
+""" Tolerance bounded waypoint decimation
+
+    Douglas-Peucker simplification of a route, optionally also bounded in heading:
+    a waypoint is dropped only if it lies within tolerance of the chord between the
+    waypoints kept around it and, when yaw is given, its yaw is within yaw_tolerance
+    degrees of the yaw interpolated along that chord. All open ranges are split in
+    the same pass, so each pass is a handful of array operations over the whole route.
+"""
+import numpy as np
+
+from line_fitting_helpers.catmull_rom_spline import wrap_degrees
+
+
+def decimate(points, tolerance, yaw=None, yaw_tolerance=None):
+    """Returns a boolean mask of the waypoints to keep.
+
+    points is an (n, d) array of positions, yaw an optional (n,) array in degrees.
+    The first and last waypoints are always kept. The result is that of the recursive
+    Douglas-Peucker algorithm using the point to segment distance.
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = n > 0
+    if n < 3:
+        return keep
+    if yaw is not None:
+        yaw = np.asarray(yaw, dtype=float)
+        if yaw_tolerance is None:
+            raise ValueError("yaw needs a yaw_tolerance")
+    tolerance = max(float(tolerance), np.finfo(float).tiny)
+    if yaw is not None:
+        yaw_tolerance = max(float(yaw_tolerance), np.finfo(float).tiny)
+    # open ranges between kept waypoints, every pass splits all of them at their worst waypoint
+    starts, ends = np.array([0]), np.array([n - 1])
+    while len(starts):
+        counts = ends - starts - 1
+        starts, ends, counts = starts[counts > 0], ends[counts > 0], counts[counts > 0]
+        if not len(starts):
+            break
+        offsets = np.cumsum(counts) - counts
+        segment = np.repeat(np.arange(len(starts)), counts)
+        index = np.arange(counts.sum()) - offsets[segment] + starts[segment] + 1
+        start, end = starts[segment], ends[segment]
+        chord = points[end] - points[start]
+        offset = points[index] - points[start]
+        length2 = np.einsum("ij,ij->i", chord, chord)
+        t = np.einsum("ij,ij->i", offset, chord) / np.where(length2 > 0, length2, 1.0)
+        t = np.clip(t, 0.0, 1.0)
+        with np.errstate(over="ignore"):
+            error = np.linalg.norm(offset - t[:, None] * chord, axis=1) / tolerance
+            if yaw is not None:
+                expected = yaw[start] + t * wrap_degrees(yaw[end] - yaw[start])
+                error = np.maximum(error, np.abs(wrap_degrees(yaw[index] - expected)) / yaw_tolerance)
+        worst = np.maximum.reduceat(error, offsets)
+        split = worst > 1.0
+        candidate = np.flatnonzero((error == worst[segment]) & split[segment])
+        _, first = np.unique(segment[candidate], return_index=True)
+        middle = index[candidate[first]]
+        keep[middle] = True
+        starts = np.concatenate([starts[split], middle])
+        ends = np.concatenate([middle, ends[split]])
+    return keep
+
+
+def decimate_route(waypoints, tolerance, yaw_tolerance=None):
+    """Decimates an (n, 4) array of x, y, z, yaw; the heading is only checked when yaw_tolerance is given.
+
+    Returns the kept waypoints and the number of waypoints dropped.
+    """
+    waypoints = np.asarray(waypoints, dtype=float)
+    keep = decimate(waypoints[:, :3], tolerance,
+                    waypoints[:, 3] if yaw_tolerance is not None else None, yaw_tolerance)
+    return waypoints[keep], int(len(keep) - keep.sum())
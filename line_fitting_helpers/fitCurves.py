@@ -4,74 +4,219 @@
     "Graphics Gems", Academic Press, 1990
 """
 from __future__ import print_function
+from collections import OrderedDict
+import hashlib
+import heapq
+import time
 from numpy import *
-import bezier
+from line_fitting_helpers import bezier
+
+# Stop reparameterizing a segment once no parameter moves by more than this
+REPARAMETERIZE_TOLERANCE = 1.0e-9
+REPARAMETERIZE_ITERATIONS = 20
+FIT_CACHE_SIZE = 4096
 
 
 # Fit one (ore more) Bezier curves to a set of points
-def fitCurve(points, maxError):
+# Pass a dict as stats to collect iteration counts, see countStats(), and a
+# FitCache to reuse the segments of a previous fit of nearly the same points
+def fitCurve(points, maxError, stats=None, cache=None):
+    points = asarray(points, dtype=float)
     leftTangent = normalize(points[1] - points[0])
     rightTangent = normalize(points[-2] - points[-1])
-    return fitCubic(points, leftTangent, rightTangent, maxError)
+    return fitCubic(points, leftTangent, rightTangent, maxError, stats, cache)
+
+
+def fitCurveAnytime(points, maxError, budget=None, maxSegments=None, stats=None, cache=None):
+    """ Fit like fitCurve, but stop refining once budget seconds have passed
+        or the chain has maxSegments segments, whichever comes first.
+
+        The segment with the largest error is always split next, so the chain
+        returned at any point is the best one found so far. Returns the chain
+        and the largest error left in it, in the units of maxError; that error
+        is below maxError only if the fit completed, in which case the chain
+        is the one fitCurve returns. """
+    start = time.time()
+    points = asarray(points, dtype=float)
+    segLengths = segmentLengths(points)
+    leaves = {}
+    worst = []
+
+    def fit(first, last, leftTangent, rightTangent):
+        bezCurve, error, splitPoint = fitCached(points[first:last+1], segLengths[first:last],
+                                                leftTangent, rightTangent, maxError, stats, cache)
+        leaves[first] = (last, bezCurve, error, splitPoint, leftTangent, rightTangent)
+        if splitPoint is not None and not error < maxError:
+            heapq.heappush(worst, (-error, first))
+
+    fit(0, len(points) - 1, normalize(points[1] - points[0]), normalize(points[-2] - points[-1]))
+    while worst:
+        if maxSegments is not None and len(leaves) >= maxSegments:
+            break
+        if budget is not None and time.time() - start >= budget:
+            break
+        first = heapq.heappop(worst)[1]
+        last, _, _, splitPoint, leftTangent, rightTangent = leaves[first]
+        countStats(stats, splits=1)
+        split = first + splitPoint
+        centerTangent = normalize(points[split-1] - points[split+1])
+        fit(first, split, leftTangent, centerTangent)
+        fit(split, last, -centerTangent, rightTangent)
+
+    ranges = sorted(leaves)
+    countStats(stats, segments=len(ranges))
+    return [leaves[first][1] for first in ranges], float(amax([leaves[first][2] for first in ranges]))
+
+
+class FitCache(object):
+    """ Remembers the fitRange result of every point range fitted so far,
+        keyed by the range's coordinates, its end tangents and the error.
+
+        When one control point moves, only the ranges containing it (and
+        the ranges whose end tangents it changes) miss the cache; every
+        other range of the split tree is spliced in from the previous fit.
+        Keys depend on content and not on indices, so inserting a point
+        does not invalidate the segments before or after it. """
+
+    def __init__(self, maxsize=FIT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def key(self, points, leftTangent, rightTangent, error):
+        digest = hashlib.sha1(ascontiguousarray(points, dtype=float).tobytes())
+        digest.update(asarray(leftTangent, dtype=float).tobytes())
+        digest.update(asarray(rightTangent, dtype=float).tobytes())
+        digest.update(repr(float(error)).encode("ascii"))
+        return digest.digest()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries[key] = self._entries.pop(key)
+        bezCurve, maxError, splitPoint = entry
+        return list(bezCurve), maxError, splitPoint
+
+    def put(self, key, bezCurve, maxError, splitPoint):
+        bezCurve = tuple(array(p, dtype=float) for p in bezCurve)
+        self._entries[key] = (bezCurve, maxError, splitPoint)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def countStats(stats, **counts):
+    """ Add counts to the stats dict: segments emitted, generateBezier
+        calls (fits), newton iterations, segments whose parameters converged
+        before the iteration limit, splits, and ranges taken from a FitCache """
+    if stats is not None:
+        for key, value in counts.items():
+            stats[key] = stats.get(key, 0) + value
+
+
+def fitCubic(points, leftTangent, rightTangent, error, stats=None, cache=None):
+    """ Split points into Bezier segments with an explicit work stack of
+        (first, last) index ranges, so long routes neither copy the points
+        at every split nor run into the recursion limit. Ranges are popped
+        left to right, giving the chain in drawing order. """
+    points = asarray(points, dtype=float)
+    segLengths = segmentLengths(points)
+
+    beziers = []
+    stack = [(0, len(points) - 1, leftTangent, rightTangent)]
+    while stack:
+        first, last, leftTangent, rightTangent = stack.pop()
+        bezCurve, maxError, splitPoint = fitCached(points[first:last+1], segLengths[first:last],
+                                                   leftTangent, rightTangent, error, stats, cache)
+        if splitPoint is None or maxError < error:
+            countStats(stats, segments=1)
+            beziers.append(bezCurve)
+            continue
+
+        # Fitting failed -- split at max error point and fit both halves
+        countStats(stats, splits=1)
+        split = first + splitPoint
+        centerTangent = normalize(points[split-1] - points[split+1])
+        stack.append((split, last, -centerTangent, rightTangent))
+        stack.append((first, split, leftTangent, centerTangent))
 
+    return beziers
 
-def fitCubic(points, leftTangent, rightTangent, error):
+
+def fitCached(points, segLengths, leftTangent, rightTangent, error, stats=None, cache=None):
+    # fitRange, through cache when there is one
+    if cache is None:
+        return fitRange(points, segLengths, leftTangent, rightTangent, error, stats)
+    key = cache.key(points, leftTangent, rightTangent, error)
+    cached = cache.get(key)
+    if cached is not None:
+        countStats(stats, cached=1)
+        return cached
+    bezCurve, maxError, splitPoint = fitRange(points, segLengths, leftTangent, rightTangent, error, stats)
+    cache.put(key, bezCurve, maxError, splitPoint)
+    return bezCurve, maxError, splitPoint
+
+
+def fitRange(points, segLengths, leftTangent, rightTangent, error, stats=None):
+    """ Fit a single Bezier to points, returning (bezCurve, maxError, splitPoint)
+        for the best attempt. splitPoint is None for two points, which are
+        always fitted by the heuristic. """
     # Use heuristic if region only has two points in it
     if (len(points) == 2):
         dist = linalg.norm(points[0] - points[1]) / 3.0
         bezCurve = [points[0], points[0] + leftTangent * dist, points[1] + rightTangent * dist, points[1]]
-        return [bezCurve]
+        return bezCurve, 0.0, None
 
     # Parameterize points, and attempt to fit curve
-    u = chordLengthParameterize(points)
+    u = chordLengthParameterize(points, segLengths)
     bezCurve = generateBezier(points, u, leftTangent, rightTangent)
     # Find max deviation of points to fitted curve
     maxError, splitPoint = computeMaxError(points, bezCurve, u)
+    countStats(stats, fits=1)
     if maxError < error:
-        return [bezCurve]
+        return bezCurve, maxError, splitPoint
 
     # If error not too large, try some reparameterization and iteration
     if maxError < error**2:
-        for i in range(20):
+        for i in range(REPARAMETERIZE_ITERATIONS):
             uPrime = reparameterize(bezCurve, points, u)
             bezCurve = generateBezier(points, uPrime, leftTangent, rightTangent)
             maxError, splitPoint = computeMaxError(points, bezCurve, uPrime)
+            countStats(stats, fits=1, newton=1)
             if maxError < error:
-                return [bezCurve]
+                return bezCurve, maxError, splitPoint
+            # Once the parameters stop moving further iterations cannot help
+            converged = abs(uPrime - u).max() <= REPARAMETERIZE_TOLERANCE
             u = uPrime
+            if converged:
+                countStats(stats, converged=1)
+                break
 
-    # Fitting failed -- split at max error point and fit recursively
-    beziers = []
-    centerTangent = normalize(points[splitPoint-1] - points[splitPoint+1])
-    beziers += fitCubic(points[:splitPoint+1], leftTangent, centerTangent, error)
-    beziers += fitCubic(points[splitPoint:], -centerTangent, rightTangent, error)
-
-    return beziers
+    return bezCurve, maxError, splitPoint
 
 
 def generateBezier(points, parameters, leftTangent, rightTangent):
     bezCurve = [points[0], None, None, points[-1]]
+    u = asarray(parameters, dtype=float)
 
-    # compute the A's
-    A = zeros((len(parameters), 2, 2))
-    for i, u in enumerate(parameters):
-        A[i][0] = leftTangent  * 3*(1-u)**2 * u
-        A[i][1] = rightTangent * 3*(1-u)    * u**2
+    # compute the A's, for all parameters at once
+    A = zeros((len(u), 2, len(leftTangent)))
+    A[:, 0] = outer(3*(1-u)**2 * u, leftTangent)
+    A[:, 1] = outer(3*(1-u)    * u**2, rightTangent)
 
     # Create the C and X matrices
-    C = zeros((2, 2))
-    X = zeros(2)
-
-    for i, (point, u) in enumerate(zip(points, parameters)):
-        C[0][0] += dot(A[i][0], A[i][0])
-        C[0][1] += dot(A[i][0], A[i][1])
-        C[1][0] += dot(A[i][0], A[i][1])
-        C[1][1] += dot(A[i][1], A[i][1])
-
-        tmp = point - bezier.q([points[0], points[0], points[-1], points[-1]], u)
-
-        X[0] += dot(A[i][0], tmp)
-        X[1] += dot(A[i][1], tmp)
+    C = einsum('nid,njd->ij', A, A)
+    tmp = points - bezier.q([points[0], points[0], points[-1], points[-1]], u[:, newaxis])
+    X = einsum('nid,nd->i', A, tmp)
 
     # Compute the determinants of C and X
     det_C0_C1 = C[0][0] * C[1][1] - C[1][0] * C[0][1]
@@ -104,7 +249,7 @@ def generateBezier(points, parameters, leftTangent, rightTangent):
 
 
 def reparameterize(bezier, points, parameters):
-    return [newtonRaphsonRootFind(bezier, point, u) for point, u in zip(points, parameters)]
+    return newtonRaphsonRootFind(bezier, points, asarray(parameters, dtype=float))
 
 
 def newtonRaphsonRootFind(bez, point, u):
@@ -122,36 +267,44 @@ def newtonRaphsonRootFind(bez, point, u):
 
        gives
        u_n+1 = u_n - |q(u_n)-p * q'(u_n)| / |q'(u_n)**2 + q(u_n)-p * q''(u_n)|
+
+       point may also be an (n, d) array with u an array of n parameters,
+       in which case all n steps are taken at once.
     """
-    d = bezier.q(bez, u)-point
-    numerator = (d * bezier.qprime(bez, u)).sum()
-    denominator = (bezier.qprime(bez, u)**2 + d * bezier.qprimeprime(bez, u)).sum()
+    t = asarray(u, dtype=float)[..., newaxis]
+    d = bezier.q(bez, t)-point
+    qprime = bezier.qprime(bez, t)
+    numerator = (d * qprime).sum(axis=-1)
+    denominator = (qprime**2 + d * bezier.qprimeprime(bez, t)).sum(axis=-1)
+
+    safe = where(denominator == 0.0, 1.0, denominator)
+    return where(denominator == 0.0, u, u - numerator/safe)
 
-    if denominator == 0.0:
-        return u
-    else:
-        return u - numerator/denominator
 
+def chordLengthParameterize(points, segLengths=None):
+    # segLengths[i] is the distance from points[i] to points[i+1]; the
+    # running sum is accumulated in order, matching a point by point loop
+    if segLengths is None:
+        segLengths = segmentLengths(points)
+    u = concatenate(([0.0], cumsum(segLengths)))
 
-def chordLengthParameterize(points):
-    u = [0.0]
-    for i in range(1, len(points)):
-        u.append(u[i-1] + linalg.norm(points[i] - points[i-1]))
+    return u / u[-1]
 
-    for i, _ in enumerate(u):
-        u[i] = u[i] / u[-1]
 
-    return u
+def segmentLengths(points):
+    # Row-wise dot products through matmul round exactly like linalg.norm on
+    # each difference vector, which keeps the fit bitwise reproducible
+    d = diff(points, axis=0)
+    return sqrt(matmul(d[:, newaxis, :], d[:, :, newaxis]).ravel())
 
 
 def computeMaxError(points, bez, parameters):
-    maxDist = 0.0
-    splitPoint = len(points)/2
-    for i, (point, u) in enumerate(zip(points, parameters)):
-        dist = linalg.norm(bezier.q(bez, u)-point)**2
-        if dist > maxDist:
-            maxDist = dist
-            splitPoint = i
+    u = asarray(parameters, dtype=float)[:, newaxis]
+    dist = ((bezier.q(bez, u) - points)**2).sum(axis=1)
+    splitPoint = int(argmax(dist))
+    maxDist = dist[splitPoint]
+    if not maxDist > 0.0:
+        return 0.0, len(points)//2
 
     return maxDist, splitPoint
 
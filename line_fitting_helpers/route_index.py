@@ -0,0 +1,181 @@
+""" Closest point queries against a route
+
+    RouteIndex is built once from a sampled polyline or from a fitted Bezier
+    chain and answers "how far is P from the route and where on it is the
+    closest point" for whole batches of points:
+
+    index = RouteIndex.from_beziers(fitCurve(points, 4.0))
+    distance, closest, param = index.query(clicks)
+
+    Segments are cut into pieces no longer than PIECE_LENGTH_FACTOR times the
+    median segment length and the piece midpoints go into a cKDTree. A query
+    only looks at the pieces whose midpoint is close enough to hold the
+    nearest point, so for points near the route its cost grows with the local
+    point density and not with the route length. The search radius grows with
+    the distance to the route, for points far from it most pieces become
+    candidates and a query approaches a scan of the whole route. The
+    candidates of all queries are then projected in one array operation.
+
+    check the answers against a brute force search over all segments with
+    python -m line_fitting_helpers.route_index [number of queries]
+"""
+from __future__ import print_function
+import numpy as np
+from scipy.spatial import cKDTree
+
+from line_fitting_helpers.bezier import bernsteinBasis, evaluateChain
+from line_fitting_helpers.fitCurves import newtonRaphsonRootFind
+
+PIECE_LENGTH_FACTOR = 2.0
+BEZIER_SAMPLES = 32
+NEWTON_ITERATIONS = 3
+
+
+class RouteIndex(object):
+    """Nearest point index over a polyline, optionally refined on a Bezier chain.
+
+    query returns, for every query point, the distance to the route, the
+    closest route point and its parameter: vertex index plus fraction along
+    the following segment for a polyline, curve index plus t for a chain.
+    """
+
+    def __init__(self, polyline, leafsize=16):
+        self.polyline = np.array(polyline, dtype=float)
+        if self.polyline.ndim != 2 or len(self.polyline) < 2:
+            raise ValueError("a route index needs at least two points, got shape {}".format(self.polyline.shape))
+        self.beziers = None
+
+        deltas = np.diff(self.polyline, axis=0)
+        lengths = np.sqrt((deltas**2).sum(axis=1))
+        moving = lengths[lengths > 0]
+        piece_length = PIECE_LENGTH_FACTOR * (np.median(moving) if len(moving) else 1.0)
+
+        # segment i is cut into pieces[i] equal pieces
+        pieces = np.maximum(1, np.ceil(lengths / piece_length)).astype(int)
+        self._segment = np.repeat(np.arange(len(lengths)), pieces)
+        first = np.cumsum(pieces) - pieces
+        k = np.arange(len(self._segment)) - np.repeat(first, pieces)
+        self._t0 = k / pieces[self._segment].astype(float)
+        self._dt = 1.0 / pieces[self._segment]
+        self._start = self.polyline[self._segment] + self._t0[:, np.newaxis] * deltas[self._segment]
+        self._delta = self._dt[:, np.newaxis] * deltas[self._segment]
+        self._length2 = (self._delta**2).sum(axis=1)
+        self._half = 0.5 * np.sqrt(self._length2.max())
+        self._tree = cKDTree(self._start + 0.5 * self._delta, leafsize=leafsize)
+
+    @classmethod
+    def from_beziers(cls, beziers, samples=BEZIER_SAMPLES, leafsize=16):
+        """Index a fitted chain, sampled with samples points per curve.
+
+        Query results are polished with a few Newton steps on the curve
+        itself, so they do not carry the sampling error.
+        """
+        index = cls(evaluateChain(beziers, samples), leafsize)
+        index.beziers = np.array(beziers, dtype=float)
+        index.samples = samples
+        return index
+
+    def query(self, points):
+        """(distance, closest point, parameter) for one point or an (m, d) array."""
+        points = np.asarray(points, dtype=float)
+        single = points.ndim == 1
+        points = np.atleast_2d(points)
+        if len(points) == 0:
+            dimension = self.polyline.shape[1]
+            return np.zeros(0), np.zeros((0, dimension)), np.zeros(0)
+
+        # the nearest midpoint lies on the route, so the nearest piece has its
+        # midpoint no further away than that plus half the longest piece
+        nearest, _ = self._tree.query(points)
+        candidates = self._tree.query_ball_point(points, nearest + self._half + 1e-9)
+        counts = np.array([len(c) for c in candidates])
+        query = np.repeat(np.arange(len(points)), counts)
+        piece = np.concatenate([np.asarray(c, dtype=int) for c in candidates])
+
+        offset = points[query] - self._start[piece]
+        length2 = np.where(self._length2[piece] > 0, self._length2[piece], 1.0)
+        t = np.clip((offset * self._delta[piece]).sum(axis=1) / length2, 0.0, 1.0)
+        distance2 = ((offset - t[:, np.newaxis] * self._delta[piece])**2).sum(axis=1)
+
+        order = np.lexsort((distance2, query))
+        best = order[np.searchsorted(query[order], np.arange(len(points)))]
+        piece, t = piece[best], t[best]
+        closest = self._start[piece] + t[:, np.newaxis] * self._delta[piece]
+        param = self._segment[piece] + self._t0[piece] + t * self._dt[piece]
+        distance = np.sqrt(distance2[best])
+
+        if self.beziers is not None:
+            distance, closest, param = self._refine(points, distance, closest, param)
+        if single:
+            return distance[0], closest[0], param[0]
+        return distance, closest, param
+
+    def _refine(self, points, distance, closest, param):
+        # polyline parameter -> curve index and t, then Newton on each curve
+        per_curve = float(self.samples - 1)
+        curve = np.minimum((param // per_curve).astype(int), len(self.beziers) - 1)
+        t = param / per_curve - curve
+        refined_distance, refined, t = self._newton(points, curve, t)
+
+        # a sample on a joint is also the end of the previous curve, whose
+        # closest point Newton cannot reach from t = 0 of the next one
+        joint = (t == 0) & (curve > 0)
+        if joint.any():
+            previous = curve[joint] - 1
+            other_distance, other, other_t = self._newton(points[joint], previous, np.ones(len(previous)))
+            closer = other_distance < refined_distance[joint]
+            which = np.flatnonzero(joint)[closer]
+            refined_distance[which] = other_distance[closer]
+            refined[which] = other[closer]
+            curve[which], t[which] = previous[closer], other_t[closer]
+
+        # keep the sampled answer where Newton wandered off
+        better = refined_distance <= distance
+        return (np.where(better, refined_distance, distance),
+                np.where(better[:, np.newaxis], refined, closest),
+                np.where(better, curve + t, param / per_curve))
+
+    def _newton(self, points, curve, t):
+        ctrl = self.beziers[curve].transpose(1, 0, 2)
+        for _ in range(NEWTON_ITERATIONS):
+            t = np.clip(newtonRaphsonRootFind(ctrl, points, t), 0.0, 1.0)
+        refined = np.einsum('mk,mkd->md', bernsteinBasis(t), self.beziers[curve])
+        return np.sqrt(((points - refined)**2).sum(axis=1)), refined, t
+
+
+def _brute_force(polyline, points):
+    """Distance from every point to the nearest segment of polyline, O(n m)."""
+    start, delta = polyline[:-1], np.diff(polyline, axis=0)
+    length2 = np.where((delta**2).sum(axis=1) > 0, (delta**2).sum(axis=1), 1.0)
+    offset = points[:, np.newaxis, :] - start[np.newaxis, :, :]
+    t = np.clip((offset * delta).sum(axis=2) / length2, 0.0, 1.0)
+    return np.sqrt(((offset - t[..., np.newaxis] * delta)**2).sum(axis=2).min(axis=1))
+
+
+def main(n_queries=1000):
+    """Queries a sinusoidal route, returns 1 if an answer is further than brute force."""
+    from line_fitting_helpers.fitCurves import fitCurve
+    x = np.linspace(0.0, 400.0, 200)
+    route = np.column_stack((x, 40.0 * np.sin(x / 60.0)))
+    rng = np.random.RandomState(0)
+    points = np.column_stack((rng.uniform(-50.0, 450.0, n_queries), rng.uniform(-100.0, 100.0, n_queries)))
+
+    index = RouteIndex(route)
+    distance, closest, _ = index.query(points)
+    polyline_error = np.abs(distance - _brute_force(route, points)).max()
+    print("polyline      {} queries, max difference to brute force {:.3g}".format(n_queries, polyline_error))
+
+    beziers = fitCurve(route, 1.0)
+    index = RouteIndex.from_beziers(beziers)
+    distance, closest, _ = index.query(points)
+    # the chords of the densely sampled chain cut the curve a little, so they
+    # may come out slightly closer than the curve itself
+    dense = evaluateChain(beziers, 1024)
+    chain_error = (distance - _brute_force(dense, points)).max()
+    print("bezier chain  {} queries, max excess over brute force {:.3g}".format(n_queries, chain_error))
+    return 1 if polyline_error > 1e-9 or chain_error > 1e-4 else 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:2]]))
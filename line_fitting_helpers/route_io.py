@@ -0,0 +1,61 @@
+""" Route csv output for computed routes
+
+    write_route_csv writes the route csv the designers write and csv_to_xml_helper.py
+    reads, from an iterable of waypoint chunks, so a route coming from iter_catmull_rom
+    is formatted one chunk at a time and never held whole. route_to_spline_csv feeds a
+    memory-mapped binary route (see binary_routes.py) through iter_catmull_rom into it.
+    Only csv is written, csv_to_xml_helper.py --engine stream turns it into xml with
+    bounded memory as well.
+
+    interpolate a binary route into a route csv with
+    python -m line_fitting_helpers.route_io <input route file> <output csv route file> [res]
+"""
+from __future__ import print_function
+import numpy as np
+
+from line_fitting_helpers import binary_routes
+from line_fitting_helpers.catmull_rom_spline import iter_catmull_rom
+
+ROUTE_KEYS = list(binary_routes.ROUTE_DTYPE.names)
+# column of yaw in ROUTE_KEYS, interpolated as an angle
+YAW_COLUMN = ROUTE_KEYS.index("yaw")
+
+
+def write_route_csv(filename, chunks, town=None, vehicle=None, mode=None):
+    """Writes a route csv from an iterable of (m, 4) x, y, z, yaw waypoint chunks.
+
+    The town,vehicle,mode metadata row is written when town is given, as the 2d
+    designer does. Returns the number of waypoints written.
+    """
+    count = 0
+    with open(filename, "w") as route_file:
+        route_file.write(",".join(ROUTE_KEYS) + "\n")
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype=float)
+            if chunk.ndim != 2 or chunk.shape[1] != len(ROUTE_KEYS):
+                raise ValueError("route chunks must be (m, {}) arrays, got shape {}".format(
+                    len(ROUTE_KEYS), chunk.shape))
+            route_file.writelines(map("{},{},{},{}\n".format, *chunk.T.tolist()))
+            count += len(chunk)
+        if town is not None:
+            route_file.write("{},{},{}".format(town, vehicle, mode))
+    return count
+
+
+def route_to_spline_csv(route_filename, csv_filename, res=8, chunk_segments=4096):
+    """Writes the Catmull-Rom spline through the waypoints of a binary route as a route csv.
+
+    The waypoints are memory-mapped and interpolated chunk_segments at a time, yaw as
+    an angle, and the metadata of the route header is kept. Returns the number of
+    waypoints written.
+    """
+    waypoints, header = binary_routes.load_route(route_filename)
+    points = binary_routes.route_array(waypoints, ROUTE_KEYS)
+    chunks = iter_catmull_rom(points, res, chunk_segments, angles=(YAW_COLUMN,))
+    return write_route_csv(csv_filename, chunks, header.get("town"), header.get("vehicle"), header.get("mode"))
+
+
+if __name__ == '__main__':
+    import sys
+    assert(len(sys.argv) in (3, 4))
+    print(route_to_spline_csv(sys.argv[1], sys.argv[2], *[int(arg) for arg in sys.argv[3:4]]), "waypoints")
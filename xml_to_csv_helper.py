@@ -0,0 +1,307 @@
+"""
+    Script usage:
+    call python xml_to_csv_helper.py <input xml file> <output csv obstacle file> <output csv route file> [--scenario <name or index>]
+    reads a scenario written by csv_to_xml_helper.py (or a bare <route>/<object> file from
+    output_xmls) back into the csv files the designers write, gzip compressed xml is read as well
+
+    batch usage:
+    call python xml_to_csv_helper.py --batch <xml directory> <output directory>
+    every scenario of every xml file is written to <name>_routes.csv and <name>_config.csv,
+    the layout csv_to_xml_helper.py --batch reads
+
+    the xml is read with iterparse and every element is dropped once handled, so memory
+    does not grow with the number of waypoints.
+"""
+from __future__ import print_function
+import argparse
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+ROUTE_KEYS = ["x", "y", "z", "yaw"]
+OBJECT_KEYS = ["x", "y", "z", "pitch", "roll", "yaw", "object_name"]
+DEFAULT_TOWN = "Town_control"
+DEFAULT_VEHICLE = "vehicle.lincoln.mkz201"
+# control characters xml does not allow, some files of output_xmls contain backspaces
+_INVALID_XML_BYTES = bytes(bytearray(c for c in range(32) if c not in (9, 10, 13)))
+
+
+class _Fragment(object):
+    """File-like wrapper putting the content of an xml file, without its declaration, under one root.
+
+    This lets iterparse read the bare <waypoint>/<object> lists kept in output_xmls, which have
+    several top level elements. Control characters xml does not allow are dropped.
+    """
+
+    def __init__(self, xml_file):
+        self.xml_file = xml_file
+        self.pending = b"<fragment>"
+        self.started = False
+        self.finished = False
+
+    def read(self, size=-1):
+        if not self.started:
+            self.started = True
+            head = self.xml_file.read(1024)
+            if head.lstrip().startswith(b"<?xml"):
+                while b"?>" not in head:
+                    more = self.xml_file.read(1024)
+                    if not more:
+                        break
+                    head += more
+                head = head[head.index(b"?>") + 2:]
+            self.pending += head.translate(None, _INVALID_XML_BYTES)
+        while not self.finished and (size < 0 or len(self.pending) < size):
+            block = self.xml_file.read(size if size > 0 else -1)
+            if not block:
+                self.pending += b"</fragment>"
+                self.finished = True
+            self.pending += block.translate(None, _INVALID_XML_BYTES)
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+def _open_xml(xml_filename):
+    """Opens an xml file for reading bytes, decompressing it when it is gzip compressed."""
+    with open(xml_filename, "rb") as xml_file:
+        compressed = xml_file.read(2) == b"\x1f\x8b"
+    if compressed:
+        import gzip
+        return gzip.open(xml_filename, "rb")
+    return open(xml_filename, "rb")
+
+
+def iter_scenario_elements(xml_filename):
+    """Yields (tag, attributes) for every scenario, ego_vehicle, object and waypoint element in file order.
+
+    A ("end_scenario", None) pair follows the elements of each scenario. Elements outside any
+    <scenario> are reported as part of a scenario with empty attributes.
+    """
+    with _open_xml(xml_filename) as xml_file:
+        stack = []
+        in_scenario = False
+        for event, element in ET.iterparse(_Fragment(xml_file), events=("start", "end")):
+            if event == "start":
+                if element.tag == "scenario":
+                    in_scenario = True
+                    yield "scenario", dict(element.attrib)
+                elif element.tag in ("ego_vehicle", "object", "waypoint") and not in_scenario:
+                    in_scenario = True
+                    yield "scenario", {}
+                stack.append(element)
+                continue
+            stack.pop()
+            if element.tag in ("ego_vehicle", "object", "waypoint"):
+                yield element.tag, element.attrib
+            elif element.tag == "scenario" or (element.tag == "fragment" and in_scenario):
+                in_scenario = False
+                yield "end_scenario", None
+            if stack:
+                stack[-1].remove(element)
+
+
+def iter_scenarios(xml_filename):
+    """Yields one dict per scenario with its name, type, town, ego (attribute dict or None),
+    objects and waypoints, the latter two as NumPy structured arrays.
+    """
+    import array
+    import numpy as np
+    for tag, attributes in iter_scenario_elements(xml_filename):
+        if tag == "scenario":
+            scenario = {"name": attributes.get("name"), "type": attributes.get("type"),
+                        "town": attributes.get("town"), "ego": None}
+            objects = []
+            waypoint_keys = None
+            waypoint_values = None
+        elif tag == "ego_vehicle":
+            scenario["ego"] = dict(attributes)
+        elif tag == "object":
+            objects.append(dict(attributes))
+        elif tag == "waypoint":
+            if waypoint_keys is None:
+                waypoint_keys = list(attributes.keys())
+                waypoint_values = [array.array("d") for _ in waypoint_keys]
+            for key, values in zip(waypoint_keys, waypoint_values):
+                values.append(float(attributes.get(key, "nan")))
+        else:
+            if waypoint_keys is None:
+                waypoint_keys, waypoint_values = ROUTE_KEYS, [array.array("d") for _ in ROUTE_KEYS]
+            waypoints = np.empty(len(waypoint_values[0]), dtype=[(key, "<f8") for key in waypoint_keys])
+            for key, values in zip(waypoint_keys, waypoint_values):
+                waypoints[key] = np.frombuffer(values, dtype="<f8") if len(values) else []
+            scenario["waypoints"] = waypoints
+            scenario["objects"] = _objects_array(objects)
+            yield scenario
+
+
+def _objects_array(objects):
+    import numpy as np
+    keys = []
+    for attributes in objects:
+        keys += [key for key in attributes if key not in keys]
+    fields = []
+    for key in keys:
+        values = [attributes.get(key, "nan") for attributes in objects]
+        try:
+            [float(value) for value in values]
+            fields.append((key, "<f8"))
+        except ValueError:
+            fields.append((key, "U{}".format(max(len(value) for value in values))))
+    result = np.empty(len(objects), dtype=fields)
+    for key, kind in fields:
+        values = [attributes.get(key, "nan") for attributes in objects]
+        result[key] = [float(value) for value in values] if kind == "<f8" else values
+    return result
+
+
+def read_scenario_xml(xml_filename):
+    """Returns the list of scenarios of an xml file, see iter_scenarios."""
+    return list(iter_scenarios(xml_filename))
+
+
+def _select(name, index, scenario):
+    if scenario is None:
+        return index == 0
+    return str(scenario) == str(index) or scenario == name
+
+
+def _iter_csv_pairs(xml_filename, filenames):
+    """Writes scenarios of xml_filename as obstacle and route csv files in one pass over the file.
+
+    filenames(index, name) returns the (obstacle csv, route csv) pair of a scenario, or None to
+    skip it. Yields (index, name, number of waypoints) once the files of a scenario are complete.
+    """
+    index = -1
+    selected = None
+    route_file = obstacle_file = None
+    try:
+        for tag, attributes in iter_scenario_elements(xml_filename):
+            if tag == "scenario":
+                index += 1
+                name = attributes.get("name")
+                selected = filenames(index, name)
+                if selected:
+                    town = attributes.get("town", DEFAULT_TOWN)
+                    vehicle = DEFAULT_VEHICLE
+                    n_objects = n_waypoints = 0
+                    obstacle_file = open(selected[0], "w")
+                    obstacle_file.write(",".join(OBJECT_KEYS) + "\n")
+                    route_file = open(selected[1], "w")
+                    route_file.write(",".join(ROUTE_KEYS) + "\n")
+            elif not selected:
+                continue
+            elif tag == "ego_vehicle":
+                vehicle = attributes.get("model", vehicle)
+            elif tag == "object":
+                values = [attributes.get("model" if key == "object_name" else key, "") for key in OBJECT_KEYS]
+                obstacle_file.write(",".join(values) + "\n")
+                n_objects += 1
+            elif tag == "waypoint":
+                route_file.write(",".join([attributes.get(key, "") for key in ROUTE_KEYS]) + "\n")
+                n_waypoints += 1
+            else:
+                route_file.write("{},{},{}".format(town, vehicle, "with_obstacle" if n_objects else "no_obstacle"))
+                for csv_file in (route_file, obstacle_file):
+                    csv_file.close()
+                route_file = obstacle_file = None
+                yield index, name, n_waypoints
+    finally:
+        for csv_file in (route_file, obstacle_file):
+            if csv_file is not None:
+                csv_file.close()
+
+
+def xml_to_csv(xml_filename, csv_filename1, csv_filename2, scenario=None):
+    """Writes one scenario of xml_filename as an obstacle csv (csv_filename1) and a route csv (csv_filename2).
+
+    scenario is a scenario name or index, the first one by default. Attribute values are copied
+    verbatim and the route ends with the town,vehicle,mode row the designers write.
+    Returns the number of waypoints written.
+    """
+    def filenames(index, name):
+        if _select(name, index, scenario):
+            return csv_filename1, csv_filename2
+        return None
+
+    pairs = _iter_csv_pairs(xml_filename, filenames)
+    try:
+        for _, _, n_waypoints in pairs:
+            return n_waypoints
+    finally:
+        pairs.close()
+    raise ValueError("no scenario {} in {}".format(scenario if scenario is not None else 0, xml_filename))
+
+
+def _move(source, target):
+    if os.path.exists(target):
+        os.remove(target)
+    os.rename(source, target)
+
+
+def batch_xml_to_csv(xml_directory, output_directory):
+    """Writes every scenario of every xml file of xml_directory as <name>_routes.csv and <name>_config.csv.
+
+    Files holding several scenarios get the scenario name (or index) appended to <name>.
+    Each file is read once, its scenarios go to temporary files that are renamed once the
+    whole file was read. A file that cannot be read is reported and skipped, nothing of it
+    is written. Returns the list of names written.
+    """
+    import glob
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    names = []
+    xml_filenames = glob.glob(os.path.join(xml_directory, "*.xml")) + glob.glob(os.path.join(xml_directory, "*.xml.gz"))
+    for xml_filename in sorted(xml_filenames):
+        base = os.path.basename(xml_filename)
+        base = base[:-len(".xml.gz")] if base.endswith(".xml.gz") else base[:-len(".xml")]
+        temporary = os.path.join(output_directory, "{}.{}".format(base, os.getpid()))
+        temporary_filenames = []
+
+        def filenames(index, name):
+            pair = ("{}.{}_config.csv.tmp".format(temporary, index), "{}.{}_routes.csv.tmp".format(temporary, index))
+            temporary_filenames.extend(pair)
+            return pair
+
+        try:
+            scenarios = list(_iter_csv_pairs(xml_filename, filenames))
+            scenario_names = [name for _, name, _ in scenarios]
+            for index, name, n_waypoints in scenarios:
+                suffix = "" if len(scenarios) == 1 else "_{}".format(
+                    name if name and scenario_names.count(name) == 1 else index)
+                prefix = os.path.join(output_directory, base + suffix)
+                _move(temporary_filenames[2 * index], prefix + "_config.csv")
+                _move(temporary_filenames[2 * index + 1], prefix + "_routes.csv")
+                print("{:>8} waypoints {}".format(n_waypoints, prefix))
+                names.append(base + suffix)
+        except (ET.ParseError, ValueError) as e:
+            print("FAILED {} ({})".format(xml_filename, e))
+        finally:
+            for temporary_filename in temporary_filenames:
+                if os.path.exists(temporary_filename):
+                    os.remove(temporary_filename)
+    return names
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="convert scenario_runner xml back to designer csv files")
+    parser.add_argument("files", nargs="*", metavar="FILE",
+                        help="<input xml file> <output csv obstacle file> <output csv route file>")
+    parser.add_argument("--scenario", default=None, help="scenario name or index (default: the first one)")
+    parser.add_argument("--batch", nargs=2, metavar=("XML_DIR", "OUTPUT_DIR"),
+                        help="convert every xml file of XML_DIR into OUTPUT_DIR")
+    args = parser.parse_args(argv)
+    if args.batch is not None:
+        if args.files:
+            parser.error("positional files cannot be combined with --batch")
+        batch_xml_to_csv(args.batch[0], args.batch[1])
+        return 0
+    if len(args.files) != 3:
+        parser.error("expected <input xml file> <output csv obstacle file> <output csv route file>")
+    xml_to_csv(args.files[0], args.files[1], args.files[2], args.scenario)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))